@@ -0,0 +1,272 @@
+import math
+import itertools
+import multiprocessing
+import numpy as np
+
+try:
+    from scipy import stats
+except ImportError:
+    stats = None
+
+def classBands(matrix, classIndex, nClasses, percentiles=(25, 75)):
+    bands = []
+
+    for classIdx in range(nClasses):
+        values = matrix[classIndex == classIdx]
+        low, high = np.nanpercentile(values, percentiles, axis=0)
+
+        bands.append({
+            'mean': np.nanmean(values, axis=0),
+            'median': np.nanmedian(values, axis=0),
+            'low': low,
+            'high': high,
+            'count': np.sum(~np.isnan(values), axis=0)
+        })
+
+    return bands
+
+def normalPValue(z):
+    return np.array([math.erfc(abs(x) / math.sqrt(2)) if x == x else np.nan for x in np.ravel(z)]).reshape(np.shape(z))
+
+def logGamma(values):
+    return np.array([math.lgamma(x) for x in np.ravel(values)]).reshape(np.shape(values))
+
+def betaContinuedFraction(a, b, x, iterations=500, epsilon=1e-15):
+    tiny = 1e-300
+    keep = lambda values: np.where(np.abs(values) < tiny, tiny, values)
+
+    c = np.ones(np.shape(x))
+    d = 1. / keep(1. - (a + b) * x / (a + 1.))
+    fraction = d.copy()
+
+    for m in range(1, iterations + 1):
+        numerator = m * (b - m) * x / ((a + 2 * m - 1.) * (a + 2 * m))
+        d = 1. / keep(1. + numerator * d)
+        c = keep(1. + numerator / c)
+        fraction *= d * c
+
+        numerator = -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1.))
+        d = 1. / keep(1. + numerator * d)
+        c = keep(1. + numerator / c)
+        fraction *= d * c
+
+        if np.all(np.abs(d * c - 1.) < epsilon):
+            break
+
+    return fraction
+
+def regularizedBeta(a, b, x):
+    a, b, x = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float), np.asarray(x, dtype=float))
+
+    with np.errstate(divide='ignore'):
+        front = np.exp(logGamma(a + b) - logGamma(a) - logGamma(b) + a * np.log(x) + b * np.log1p(-x))
+
+    lower = x < (a + 1.) / (a + b + 2.)
+    result = np.empty(x.shape)
+    result[lower] = front[lower] * betaContinuedFraction(a[lower], b[lower], x[lower]) / a[lower]
+    result[~lower] = 1. - front[~lower] * betaContinuedFraction(b[~lower], a[~lower], 1. - x[~lower]) / b[~lower]
+
+    return result
+
+def studentPValue(t, df):
+    t, df = np.broadcast_arrays(np.asarray(t, dtype=float), np.asarray(df, dtype=float))
+    p = np.full(t.shape, np.nan)
+
+    with np.errstate(invalid='ignore'):
+        finite = ~np.isnan(t) & (df > 0) & np.isfinite(df)
+        infinite = ~np.isnan(t) & np.isinf(df)
+
+    p[finite] = regularizedBeta(df[finite] / 2., 0.5, df[finite] / (df[finite] + t[finite] ** 2))
+    p[infinite] = normalPValue(t[infinite])
+
+    return p
+
+def welchTest(a, b):
+    na = np.sum(~np.isnan(a), axis=0).astype(float)
+    nb = np.sum(~np.isnan(b), axis=0).astype(float)
+    va = np.nanvar(a, axis=0, ddof=1) / na
+    vb = np.nanvar(b, axis=0, ddof=1) / nb
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (np.nanmean(a, axis=0) - np.nanmean(b, axis=0)) / np.sqrt(va + vb)
+        df = (va + vb) ** 2 / (va ** 2 / (na - 1) + vb ** 2 / (nb - 1))
+
+    if stats is not None:
+        p = 2 * stats.t.sf(np.abs(t), df)
+    else:
+        p = studentPValue(t, df)
+
+    return t, p
+
+def significantSlices(matrix, classIndex, classes, alpha=0.05):
+    markers = []
+
+    for i, j in itertools.combinations(range(len(classes)), 2):
+        t, p = welchTest(matrix[classIndex == i], matrix[classIndex == j])
+
+        with np.errstate(invalid='ignore'):
+            markers.append(((classes[i], classes[j]), p < alpha))
+
+    return markers
+
+def rankColumns(matrix):
+    n, columns = matrix.shape
+    cols = np.arange(columns)
+    order = np.argsort(matrix, axis=0, kind='mergesort')
+    ordered = matrix[order, cols]
+
+    position = np.arange(1, n + 1, dtype=float)[:, np.newaxis] * np.ones(columns)
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[1:] = ordered[1:] != ordered[:-1]
+    ends = np.ones(ordered.shape, dtype=bool)
+    ends[:-1] = starts[1:]
+
+    first = np.maximum.accumulate(np.where(starts, position, 0), axis=0)
+    last = np.minimum.accumulate(np.where(ends, position, n + 1)[::-1], axis=0)[::-1]
+
+    ranks = np.empty(matrix.shape)
+    ties = np.empty(matrix.shape)
+    ranks[order, cols] = (first + last) / 2.
+    ties[order, cols] = (last - first + 1) ** 2 - 1
+
+    missing = np.isnan(matrix)
+    ranks[missing] = np.nan
+    ties[missing] = 0
+
+    return ranks, ties
+
+def mannWhitneyTest(a, b):
+    na = np.sum(~np.isnan(a), axis=0).astype(float)
+    nb = np.sum(~np.isnan(b), axis=0).astype(float)
+    n = na + nb
+    ranks, ties = rankColumns(np.vstack([a, b]))
+
+    u = np.nansum(ranks[:len(a)], axis=0) - na * (na + 1) / 2.
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = np.sqrt(na * nb / 12. * ((n + 1) - ties.sum(axis=0) / (n * (n - 1))))
+        z = np.maximum(np.abs(u - na * nb / 2.) - 0.5, 0) / sigma
+
+    z[(na == 0) | (nb == 0)] = np.nan
+
+    if stats is not None:
+        with np.errstate(invalid='ignore'):
+            p = 2 * stats.norm.sf(z)
+    else:
+        p = normalPValue(z)
+
+    return u, np.minimum(p, 1.)
+
+def makePermutationRng(seed, chunk):
+    seed = None if seed is None else [seed, chunk]
+
+    if hasattr(np.random, 'default_rng'):
+        return np.random.default_rng(seed)
+
+    return np.random.RandomState(seed)
+
+def meanDifference(groupSums, groupCounts, totalSums, totalCounts):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return groupSums / groupCounts - (totalSums - groupSums) / (totalCounts - groupCounts)
+
+def countPermutations(task):
+    values, present, na, observed, permutations, seed, chunk, batchSize = task
+    rng = makePermutationRng(seed, chunk)
+    totalSums, totalCounts = values.sum(axis=0), present.sum(axis=0)
+    exceed = np.zeros(values.shape[1], dtype=np.intp)
+
+    for start in range(0, permutations, batchSize):
+        size = min(batchSize, permutations - start)
+        keys = rng.uniform(size=(size, len(values)))
+        labels = (keys <= np.partition(keys, na - 1, axis=1)[:, na - 1:na]).astype(float)
+        differences = meanDifference(labels.dot(values), labels.dot(present), totalSums, totalCounts)
+
+        with np.errstate(invalid='ignore'):
+            exceed += np.sum(np.abs(differences) >= observed - 1e-12, axis=0)
+
+    return exceed
+
+def permutationTest(a, b, permutations=10000, seed=None, processes=1, batchSize=1000):
+    matrix = np.vstack([a, b])
+    present = (~np.isnan(matrix)).astype(float)
+    values = np.where(np.isnan(matrix), 0., matrix)
+
+    observed = np.abs(meanDifference(values[:len(a)].sum(axis=0), present[:len(a)].sum(axis=0), values.sum(axis=0), present.sum(axis=0)))
+
+    chunks = max(1, min(processes, permutations // batchSize))
+    sizes = [permutations // chunks + (1 if i < permutations % chunks else 0) for i in range(chunks)]
+    tasks = [(values, present, len(a), observed, size, seed, i, batchSize) for i, size in enumerate(sizes)]
+
+    if chunks == 1:
+        exceed = countPermutations(tasks[0])
+    else:
+        pool = multiprocessing.Pool(chunks)
+
+        try:
+            exceed = np.sum(pool.map(countPermutations, tasks), axis=0)
+        finally:
+            pool.close()
+            pool.join()
+
+    p = (exceed + 1.) / (permutations + 1.)
+    p[np.isnan(observed)] = np.nan
+
+    return observed, p
+
+def fdrCorrection(p):
+    p = np.asarray(p, dtype=float)
+    q = np.full(p.shape, np.nan)
+    finite = np.isfinite(p)
+    values = p[finite]
+
+    if values.size:
+        order = np.argsort(values)
+        adjusted = values[order] * values.size / np.arange(1, values.size + 1)
+        adjusted = np.minimum.accumulate(adjusted[::-1])[::-1]
+        corrected = np.empty(values.size)
+        corrected[order] = np.minimum(adjusted, 1.)
+        q[finite] = corrected
+
+    return q
+
+def significantRanges(mask, grid):
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+    return [(grid[start], grid[end]) for start, end in zip(starts, ends)]
+
+comparisonTests = {
+    'welch': welchTest,
+    'mannwhitney': mannWhitneyTest,
+    'permutation': permutationTest
+}
+
+def compareClasses(matrix, classIndex, classes, tests=('welch', 'mannwhitney', 'permutation'), alpha=0.05,
+                   permutations=10000, seed=None, processes=1):
+    comparisons = []
+
+    for i, j in itertools.combinations(range(len(classes)), 2):
+        a, b = matrix[classIndex == i], matrix[classIndex == j]
+        comparison = {'classes': (classes[i], classes[j])}
+
+        for test in tests:
+            if test == 'permutation':
+                statistic, p = permutationTest(a, b, permutations, seed, processes)
+            else:
+                statistic, p = comparisonTests[test](a, b)
+
+            comparison[test] = {'statistic': statistic, 'p': p}
+
+        comparisons.append(comparison)
+
+    for test in tests:
+        q = fdrCorrection(np.array([comparison[test]['p'] for comparison in comparisons]))
+
+        for comparison, testQ in zip(comparisons, q):
+            comparison[test]['q'] = testQ
+
+            with np.errstate(invalid='ignore'):
+                comparison[test]['significant'] = testQ < alpha
+
+    return comparisons
@@ -0,0 +1,123 @@
+import os
+import hashlib
+import zipfile
+import tempfile
+import numpy as np
+
+import pandas as pd
+from pandas import DataFrame
+
+from fish_discovery import parseStatisticsName
+
+if tuple(int(v) for v in pd.__version__.split('.')[:2]) >= (1, 5):
+    csvNewline = {'lineterminator': '\r\n'}
+else:
+    csvNewline = {'line_terminator': '\r\n'}
+
+class FishDataCache:
+    def __init__(self, _cacheDir, _maxSize=512 * 1024 * 1024):
+        self.cacheDir = _cacheDir
+        self.maxSize = _maxSize
+        self.totalSize = None
+
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+    def getEntryPath(self, path, sep):
+        st = os.stat(path)
+        key = '%s|%r|%d|%r' % (os.path.abspath(path), st.st_mtime, st.st_size, sep)
+
+        return os.path.join(self.cacheDir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+    def load(self, entryPath, usecols=None):
+        with np.load(entryPath) as entry:
+            columns = entry['columns'].tolist()
+            indices = range(len(columns))
+
+            if usecols is not None:
+                indices = [columns.index(c) for c in usecols if c in columns]
+
+            dataFrame = DataFrame(dict((columns[i], entry['c%d' % i]) for i in indices),
+                                  columns=[columns[i] for i in indices])
+            meta = tuple(entry['meta'].tolist()) if entry['meta'].size else None
+
+        os.utime(entryPath, None)
+
+        return dataFrame, meta
+
+    def store(self, entryPath, dataFrame, meta):
+        if not all(np.issubdtype(dtype, np.number) for dtype in dataFrame.dtypes):
+            return
+
+        arrays = dict(('c%d' % i, dataFrame[c].values) for i, c in enumerate(dataFrame.columns))
+        arrays['columns'] = np.array(dataFrame.columns.tolist())
+        arrays['meta'] = np.array(meta if meta else [], dtype=float)
+
+        fd, tmpPath = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+
+        with os.fdopen(fd, 'wb') as fp:
+            np.savez(fp, **arrays)
+
+        os.rename(tmpPath, entryPath)
+
+        if self.totalSize is not None:
+            self.totalSize += os.path.getsize(entryPath)
+
+        if self.totalSize is None or self.totalSize > self.maxSize:
+            self.evict()
+
+    def evict(self):
+        entries = []
+
+        for f in os.listdir(self.cacheDir):
+            if f.endswith('.npz'):
+                st = os.stat(os.path.join(self.cacheDir, f))
+                entries.append((st.st_mtime, st.st_size, f))
+
+        self.totalSize = sum(size for _, size, _ in entries)
+
+        for mtime, size, f in sorted(entries):
+            if self.totalSize <= self.maxSize:
+                break
+
+            os.remove(os.path.join(self.cacheDir, f))
+            self.totalSize -= size
+
+    def readStatistics(self, path, sep=';', usecols=None, dtype=None):
+        entryPath = self.getEntryPath(path, sep)
+
+        if os.path.exists(entryPath):
+            try:
+                dataFrame, meta = self.load(entryPath, usecols)
+            except (IOError, KeyError, ValueError, zipfile.BadZipfile):
+                os.remove(entryPath)
+            else:
+                checkColumns(path, dataFrame, usecols)
+
+                return (dataFrame.astype(dtype) if dtype else dataFrame), meta
+
+        dataFrame = pd.read_csv(path, sep=sep)
+        meta = parseStatisticsName(path)
+
+        self.store(entryPath, dataFrame, meta)
+
+        if usecols is not None:
+            checkColumns(path, dataFrame, usecols)
+            dataFrame = dataFrame[list(usecols)]
+
+        return (dataFrame.astype(dtype) if dtype else dataFrame), meta
+
+def checkColumns(path, dataFrame, usecols):
+    missing = [column for column in usecols or () if column not in dataFrame.columns]
+
+    if missing:
+        raise ValueError('%s has no column %s' % (path, ', '.join(missing)))
+
+def readHeader(path, sep=';'):
+    return pd.read_csv(path, sep=sep, nrows=0).columns.tolist()
+
+def readStatistics(path, sep=';', cache=None, usecols=None, dtype=None):
+    if cache is not None:
+        return cache.readStatistics(path, sep, usecols, dtype)
+
+    return pd.read_csv(path, sep=sep, usecols=usecols, dtype=dtype), parseStatisticsName(path)
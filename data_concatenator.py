@@ -1,19 +1,18 @@
 import os
 import sys
 import ast
-import matplotlib.pyplot as plt
 import numpy as np
-import itertools
-from io import BytesIO
-import matplotlib.pyplot as plt
-import matplotlib.cm as cmx
-import matplotlib.colors as colors
-import matplotlib.ticker as mtick
-import csv
 
 import pandas as pd
 from pandas import DataFrame
 
+from data_cache import FishDataCache, readStatistics, csvNewline
+from fish_cohort import FishCohort, CohortBuilder, makeGrid
+from fish_metrics import getRequiredColumns
+from fish_discovery import FishIndex, prefetch
+from fish_store import FishStore
+from pipeline_trace import PipelineTrace
+
 class FishData:
     def __init__(self, _label=None, _class=None, _volume=0, _surface=0, _length=0, _area=[], _perim=[], _width=[], _height=[], _normalize=True):
         self.volume = _volume
@@ -25,6 +24,8 @@ class FishData:
         self.perim = _perim
         self.width = _width
         self.height = _height
+        self.rawArea = _area
+        self.cohort = None
 
         if _normalize and self.volume:
             self.area = self.area / self.volume
@@ -38,110 +39,138 @@ class FishData:
     def getLength(self):
         return self.length
 
+    def getArea(self):
+        return self.area
+
+    def getLabel(self):
+        return self.label
+
     def getWidth(self):
-        return self.width.max()
+        return self.getDataByColumn('Width')
 
     def getHeight(self):
-        return self.height.max()
+        return self.getDataByColumn('Height')
 
     def getCircularity(self):
-        return 2.0*np.sqrt(self.area) / self.perim
+        return self.getDataByColumn('Circularity')
 
-    def getArea(self):
-        return self.area
+    def getDataByColumn(self, column):
+        if self.cohort is None:
+            self.cohort = FishCohort.fromFishData([self])
 
-    def getLabel(self):
-        return self.label
+        values = self.cohort.getDataByColumn(column)
 
-    def getDataByColumn(self, column):
-        if column == 'Volume':
-            return self.getVolume()
-        elif column == 'Surface':
-            return self.getSurface()
-        elif column == 'Length':
-            return self.getLength()
-        elif column == 'Width':
-            return self.getWidth()
-        elif column == 'Height':
-            return self.getHeight()
-        elif column == 'Circularity':
-            return self.getCircularity()
-        elif column == 'Area':
-            return self.getArea()
-        else:
-            return None
+        return None if values is None else values[0]
 
 class FishDataConcatenator:
-    def __init__(self, _args, _statisticsDir, _outputPath, _methodPrefix='statistics', _mandatoryStats=['Area', 'Circularity', 'Volume', 'Surface', 'Width', 'Height', 'Length']):
+    def __init__(self, _args, _statisticsDir, _outputPath, _methodPrefix='statistics', _mandatoryStats=['Area', 'Circularity', 'Volume', 'Surface', 'Width', 'Height', 'Length'], _cacheDir=None, _outputFormat='csv', _gridStep=None, _ioWorkers=1, _traceFile=None, _traceFormat='json', _storeDir=None):
         self.statisticsDir = _statisticsDir
         self.mandatoryStats = _mandatoryStats
         self.outputPath = _outputPath
         self.args = ast.literal_eval(_args)
         self.methodPrefix = _methodPrefix
+        self.cache = FishDataCache(_cacheDir) if _cacheDir else None
+        self.index = FishIndex(_statisticsDir, _methodPrefix, _cacheDir)
+        self.store = FishStore(_storeDir) if _storeDir else None
+        self.outputFormat = _outputFormat
+        self.gridStep = _gridStep
+        self.ioWorkers = _ioWorkers
+        self.trace = PipelineTrace()
+        self.traceFile = _traceFile
+        self.traceFormat = _traceFormat
+
+        if self.outputFormat not in ('csv', 'parquet', 'feather', 'xlsx'):
+            raise ValueError('Unsupported output format: %s' % self.outputFormat)
 
     def readFishData(self, inputPath, fishClasses):
-        fishesData = []
-        cols = []
+        columns = getRequiredColumns(self.mandatoryStats)
 
-        totalVolumeSize = 0.
-        totalSurfaceSize = 0.
-        totalVolumeLength = 0
+        if self.store is not None:
+            with self.trace.stage('normalization'):
+                data = self.store.readCohort(fishClasses, columns)
 
-        for fishClass, fishNames in self.args.items():
-            for fishName in fishNames:
-                dataPath = os.path.join(inputPath, fishName)
-                files = [f for f in os.listdir(dataPath) if os.path.isfile(os.path.join(dataPath,f)) and f.startswith(self.methodPrefix)]
+                return data.resample(makeGrid(self.gridStep), self.mandatoryStats) if self.gridStep else data
 
-                if files:
-                    name_comps = files[0].split('_')
+        dtype = dict((column, np.float64) for column in columns)
+        builder = CohortBuilder(columns, makeGrid(self.gridStep) if self.gridStep else None, _metrics=self.mandatoryStats)
 
-                    if float(name_comps[1]):
-                        totalVolumeSize = float(name_comps[1])
+        fishes = [(fishClass, fishName) for fishClass, fishNames in self.args.items() for fishName in fishNames]
+        index = self.index if inputPath == self.statisticsDir else FishIndex(inputPath, self.methodPrefix)
 
-                    if float(name_comps[2]):
-                        totalSurfaceSize = float(name_comps[2])
+        with self.trace.stage('discovery'):
+            files = index.locate([fishName for fishClass, fishName in fishes], self.ioWorkers)
 
-                    if float(name_comps[3][1:]) and float(name_comps[4][1:]):
-                        totalVolumeLength = float(name_comps[4][1:]) - float(name_comps[3][1:])
-                    
-                    dataFrame = pd.read_csv(os.path.join(dataPath, files[0]), sep=';')
+        sources = [(fishClass, fishName) + files[fishName] for fishClass, fishName in fishes if files[fishName]]
+        self.trace.count('discovery', fish=len(fishes), found=len(sources))
 
-                    area = np.array(dataFrame['Area'], dtype=float)
-                    perim = np.array(dataFrame['Perim.'], dtype=float)
-                    width = np.array(dataFrame['Width'], dtype=float)
-                    height = np.array(dataFrame['Height'], dtype=float)
+        read = lambda source: self.parseStatistics(source, columns, dtype)
 
-                    fishEntry = FishData(fishName, fishClass, totalVolumeSize, totalSurfaceSize, totalVolumeLength, area, perim, width, height)
-                    fishesData.append(fishEntry)
+        for (fishClass, fishName, sourceFile, fishMeta), (dataFrame, meta) in zip(sources, prefetch(sources, read, self.ioWorkers)):
+            self.trace.count('parsing', fish=1, rows=len(dataFrame), bytesRead=os.path.getsize(sourceFile))
 
-        return fishesData
+            with self.trace.stage('normalization', fish=fishName):
+                builder.add(fishName, fishClass, dict((column, dataFrame[column].values) for column in columns), *fishMeta)
 
-    def generateSpreadsheet(self, data, column):
-        with open(os.path.join(self.outputPath, column + '.csv'), 'wb') as fp:
-            writer = csv.writer(fp, delimiter=';')
+        with self.trace.stage('normalization'):
+            return builder.build()
 
-            if column == 'Volume' or column == 'Surface' or column == 'Width' or column == 'Height' or column == 'Length':
-                writer.writerow([' ',column])
+    def parseStatistics(self, source, columns=None, dtype=None):
+        with self.trace.stage('parsing', fish=source[1]):
+            return readStatistics(source[2], ';', self.cache, columns, dtype)
 
-                for fish in data:
-                    writer.writerow([fish.getLabel(),fish.getDataByColumn(column)])
+    def getSpreadsheetFrame(self, data, column):
+        with self.trace.stage('metrics', column=column):
+            values = data.getDataByColumn(column)
 
-            else:
-                n_data = len(data[0].getDataByColumn(column))
+        if values.ndim == 1:
+            return DataFrame({column: values}, index=pd.Index(data.labels.tolist(), name='Label'))
 
-                writer.writerow([fish.getLabel() for fish in data])
+        if data.grid is not None:
+            return DataFrame(values.T, columns=data.labels.tolist(), index=pd.Index(data.grid, name='Slice (%)'))
+
+        return DataFrame(values.T, columns=data.labels.tolist())
+
+    def generateSpreadsheet(self, data, column):
+        dataFrame = self.getSpreadsheetFrame(data, column)
+        outputFile = os.path.join(self.outputPath, column + '.' + self.outputFormat)
+        hasIndex = dataFrame.index.name is not None
 
-                for i in range(n_data):
-                    writer.writerow([fish.getDataByColumn(column)[i] for fish in data])
+        with self.trace.stage('export', column=column):
+            if self.outputFormat == 'csv':
+                indexLabel = ' ' if dataFrame.index.name == 'Label' else dataFrame.index.name
+                dataFrame.to_csv(outputFile, sep=';', index=hasIndex, index_label=indexLabel, na_rep='', **csvNewline)
+            elif self.outputFormat == 'parquet':
+                dataFrame.to_parquet(outputFile, index=hasIndex)
+            elif self.outputFormat == 'feather':
+                (dataFrame.reset_index() if hasIndex else dataFrame).to_feather(outputFile)
+
+        self.trace.count('export', bytesWritten=os.path.getsize(outputFile))
 
     def generateSpreadsheets(self):
         data = self.readFishData(self.statisticsDir, self.args)
+        self.writeSpreadsheets(data)
+
+        if self.traceFile:
+            self.trace.write(self.traceFile, self.traceFormat)
 
+    def writeSpreadsheets(self, data):
         if not os.path.exists(self.outputPath):
             os.makedirs(self.outputPath)
 
-        for column in self.mandatoryStats:
-            self.generateSpreadsheet(data, column)
+        if self.outputFormat == 'xlsx':
+            writer = pd.ExcelWriter(os.path.join(self.outputPath, 'spreadsheets.xlsx'))
+
+            try:
+                for column in self.mandatoryStats:
+                    dataFrame = self.getSpreadsheetFrame(data, column)
+
+                    with self.trace.stage('export', column=column):
+                        dataFrame.to_excel(writer, sheet_name=column[:31], index=dataFrame.index.name is not None)
+            finally:
+                writer.close()
+        else:
+            for column in self.mandatoryStats:
+                self.generateSpreadsheet(data, column)
 
 def main(args):
     dataConcatenator = FishDataConcatenator(args, 'E:\Report generator\Results', 'E:\Report generator\Spreadsheets')
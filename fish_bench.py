@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import traceback
+import multiprocessing
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import matplotlib
+matplotlib.use('Agg')
+
+from fish_gen import FishMaker
+from report_gen import FishReport
+from data_concatenator import FishDataConcatenator
+from class_stats import classBands
+from fish_cohort import makeGrid
+from pipeline_trace import peakRss
+
+def timeStage(stages, name, func, *args):
+    start = time.time()
+    value = func(*args)
+    stages[name] = {'wall': time.time() - start, 'peakRss': peakRss()}
+
+    return value
+
+def computeMetrics(cohort, metrics):
+    values = dict((metric, cohort.getDataByColumn(metric)) for metric in metrics)
+    aligned = cohort if cohort.grid is not None else cohort.resample(makeGrid(1))
+
+    for metric in metrics:
+        if values[metric].ndim == 2:
+            classBands(aligned.getDataByColumn(metric), aligned.classIndex, len(aligned.classes))
+
+    return values
+
+def runScale(workDir, numFish, sliceRange, seed, plotMode, genProcesses, queue):
+    try:
+        queue.put(measureScale(workDir, numFish, sliceRange, seed, plotMode, genProcesses))
+    except Exception:
+        queue.put({'error': traceback.format_exc()})
+        raise
+
+def measureScale(workDir, numFish, sliceRange, seed, plotMode, genProcesses):
+    cohortDir = os.path.join(workDir, 'cohort_%d' % numFish)
+    stages = {}
+
+    maker = FishMaker(range(numFish), _seed=seed, _sliceRange=sliceRange)
+    paths = timeStage(stages, 'generation', maker.generate_statistics, cohortDir, genProcesses)
+
+    fishNames = [maker.fishPrefix + str(fishNumber) for fishNumber in maker.fishNumbers]
+    args = repr({'ClassA': fishNames[::2], 'ClassB': fishNames[1::2]})
+
+    report = FishReport(args, cohortDir, _docName=os.path.join(workDir, 'report_%d.pdf' % numFish),
+                        _mandatoryStats=['Area', 'Circularity'], _plotMode=plotMode, _streaming=True)
+    cohort = timeStage(stages, 'ingestion', report.readCohort, cohortDir)
+    timeStage(stages, 'metrics', computeMetrics, cohort, ['Area', 'Circularity', 'Volume', 'Surface', 'Length'])
+    plots = timeStage(stages, 'rendering', report.renderPlots, cohort, report.mandatoryStats)
+    timeStage(stages, 'pdf', report.buildDocument, plots)
+
+    concatenator = FishDataConcatenator(args, cohortDir, os.path.join(workDir, 'spreadsheets_%d' % numFish))
+    data = concatenator.readFishData(cohortDir, concatenator.args)
+    timeStage(stages, 'spreadsheets', concatenator.writeSpreadsheets, data)
+
+    return {
+        'fish': numFish,
+        'slices': int(data.lengths.sum()),
+        'inputBytes': sum(os.path.getsize(path) for path in paths),
+        'stages': stages
+    }
+
+def waitForResult(process, queue, numFish, poll=1.0):
+    while True:
+        try:
+            result = queue.get(timeout=poll)
+            break
+        except Empty:
+            if not process.is_alive():
+                try:
+                    result = queue.get(timeout=poll)
+                    break
+                except Empty:
+                    raise RuntimeError('Benchmark at %d fish exited with code %s and no result' % (numFish, process.exitcode))
+
+    if 'error' in result:
+        raise RuntimeError('Benchmark at %d fish failed:\n%s' % (numFish, result['error']))
+
+    return result
+
+def runBenchmark(scales, sliceRange=(50, 2000), seed=0, plotMode='lines', workDir=None, keep=False, label=None, genProcesses=1):
+    cleanup = workDir is None and not keep
+    workDir = workDir or tempfile.mkdtemp(prefix='fish-bench-')
+    results = []
+
+    try:
+        for numFish in scales:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=runScale, args=(workDir, numFish, sliceRange, seed, plotMode, genProcesses, queue))
+            process.start()
+
+            try:
+                results.append(waitForResult(process, queue, numFish))
+            finally:
+                process.join()
+    finally:
+        if cleanup:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    return {
+        'label': label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': multiprocessing.cpu_count(),
+        'seed': seed,
+        'sliceRange': list(sliceRange),
+        'plotMode': plotMode,
+        'results': results
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the report pipeline on synthetic cohorts.')
+    parser.add_argument('--scales', default='10,100,1000', help='comma-separated cohort sizes (number of fish)')
+    parser.add_argument('--min-slices', type=int, default=50)
+    parser.add_argument('--max-slices', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--plot-mode', choices=['lines', 'bands'], default='lines')
+    parser.add_argument('--work-dir', default=None, help='where cohorts and outputs are written (temporary by default)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated cohorts and outputs')
+    parser.add_argument('--label', default=None, help='version label stored with the results')
+    parser.add_argument('--gen-processes', type=int, default=1, help='processes used to generate cohorts (0 for all cores)')
+    parser.add_argument('--output', default='bench.json')
+    options = parser.parse_args(argv)
+
+    results = runBenchmark([int(s) for s in options.scales.split(',')], (options.min_slices, options.max_slices),
+                           options.seed, options.plot_mode, options.work_dir, options.keep, options.label,
+                           options.gen_processes or None)
+
+    with open(options.output, 'w') as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
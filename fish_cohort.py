@@ -0,0 +1,212 @@
+import numpy as np
+
+from fish_metrics import metricRegistry, reductions
+
+def indexClasses(classNames):
+    classes = []
+
+    for className in classNames:
+        if className not in classes:
+            classes.append(className)
+
+    return classes, [classes.index(c) for c in classNames]
+
+def padSeries(arrays, dtype=np.float64):
+    lengths = np.array([len(a) for a in arrays], dtype=np.intp)
+    padded = np.full((len(arrays), lengths.max() if len(arrays) else 0), np.nan, dtype=dtype)
+
+    if len(arrays):
+        padded[np.arange(padded.shape[1]) < lengths[:, np.newaxis]] = np.concatenate(arrays)
+
+    return padded, lengths
+
+def makeGrid(step):
+    return np.linspace(0, 100, int(round(100. / step)) + 1)
+
+def resampleSeries(padded, lengths, grid):
+    last = np.maximum(lengths - 1, 0)[:, np.newaxis]
+    position = np.asarray(grid, dtype=float)[np.newaxis, :] / 100. * last
+    lower = np.floor(position).astype(np.intp)
+    upper = np.minimum(lower + 1, last)
+    weight = position - lower
+    rows = np.arange(padded.shape[0])[:, np.newaxis]
+
+    if not padded.shape[1]:
+        return np.full(position.shape, np.nan, dtype=padded.dtype)
+
+    return padded[rows, lower] * (1 - weight) + padded[rows, upper] * weight
+
+class FishCohort:
+    def __init__(self, _labels, _classes, _classIndex, _lengths, _series, _volume=None, _surface=None, _length=None, _grid=None, _voxelSize=(1, 1, 1), _sliceCounts=None):
+        self.labels = np.asarray(_labels, dtype=object)
+        self.classes = list(_classes)
+        self.classIndex = np.asarray(_classIndex, dtype=np.intp)
+        self.lengths = np.asarray(_lengths, dtype=np.intp)
+        self.series = _series
+        self.volume = np.zeros(len(self.labels)) if _volume is None else np.asarray(_volume, dtype=float)
+        self.surface = np.zeros(len(self.labels)) if _surface is None else np.asarray(_surface, dtype=float)
+        self.length = np.zeros(len(self.labels)) if _length is None else np.asarray(_length, dtype=float)
+        self.grid = _grid
+        self.voxelSize = _voxelSize
+        self.sliceCounts = self.lengths if _sliceCounts is None else np.asarray(_sliceCounts, dtype=np.intp)
+        self.derived = {}
+        self.reductions = {}
+
+    @classmethod
+    def fromSeries(cls, labels, classNames, series, volume=None, surface=None, length=None, dtype=np.float64):
+        classes, classIndex = indexClasses(classNames)
+        padded = {}
+        lengths = np.zeros(len(labels), dtype=np.intp)
+
+        for column, arrays in series.items():
+            padded[column], columnLengths = padSeries(arrays, dtype)
+            lengths = np.maximum(lengths, columnLengths)
+
+        return cls(labels, classes, classIndex, lengths, padded, volume, surface, length)
+
+    @classmethod
+    def fromFishData(cls, fishesData, dtype=np.float64):
+        series = {
+            'Area': [fish.rawArea for fish in fishesData],
+            'Perim.': [fish.perim for fish in fishesData],
+            'Width': [fish.width for fish in fishesData],
+            'Height': [fish.height for fish in fishesData]
+        }
+
+        return cls.fromSeries([fish.label for fish in fishesData], [fish.fclass for fish in fishesData], series,
+                              [fish.volume for fish in fishesData], [fish.surface for fish in fishesData],
+                              [fish.length for fish in fishesData], dtype=dtype)
+
+    def resample(self, grid, metrics=None):
+        series = dict((column, resampleSeries(values, self.lengths, grid)) for column, values in self.series.items())
+        lengths = np.full(len(self.labels), len(grid), dtype=np.intp)
+
+        cohort = FishCohort(self.labels, self.classes, self.classIndex, lengths, series,
+                            self.volume, self.surface, self.length, np.asarray(grid, dtype=float), self.voxelSize, self.sliceCounts)
+        names = self.getMetricNames(metrics)
+
+        for name in self.getMetricNames():
+            metric = metricRegistry[name]
+
+            if metric.scalar:
+                for kind, column in metric.reductions:
+                    cohort.reductions[(kind, column)] = self.getReduction(kind, column)
+            elif name in names:
+                cohort.derived[metric.getKey(self.voxelSize)] = resampleSeries(self.getMetric(name), self.lengths, grid)
+
+        return cohort
+
+    def select(self, indices, classNames=None):
+        indices = np.asarray(indices, dtype=np.intp)
+
+        if classNames is None:
+            classNames = [self.classes[classIdx] for classIdx in self.classIndex[indices]]
+
+        classes, classIndex = indexClasses(classNames)
+        lengths = self.lengths[indices]
+        width = lengths.max() if self.grid is None and len(indices) else None
+        series = dict((column, values[indices, :width]) for column, values in self.series.items())
+
+        cohort = FishCohort(self.labels[indices], classes, classIndex, lengths, series, self.volume[indices],
+                            self.surface[indices], self.length[indices], self.grid, self.voxelSize, self.sliceCounts[indices])
+        cohort.derived = dict((key, values[indices, :width] if values.ndim == 2 else values[indices])
+                              for key, values in self.derived.items())
+        cohort.reductions = dict((key, values[indices]) for key, values in self.reductions.items())
+
+        return cohort
+
+    def __len__(self):
+        return len(self.labels)
+
+    def getClassMask(self, className):
+        return self.classIndex == self.classes.index(className)
+
+    def getFishSeries(self, column, index, voxelSize=None):
+        return self.getDataByColumn(column, voxelSize)[index, :self.lengths[index]]
+
+    def hasMetric(self, name):
+        return name in metricRegistry and all(column in self.series for column in metricRegistry[name].columns)
+
+    def getMetricNames(self, metrics=None):
+        return [name for name in (metricRegistry if metrics is None else metrics) if self.hasMetric(name)]
+
+    def getReduction(self, kind, column):
+        key = (kind, column)
+
+        if key not in self.reductions:
+            self.reductions[key] = reductions[kind](self.series[column])
+
+        return self.reductions[key]
+
+    def getMetric(self, name, voxelSize=None):
+        metric = metricRegistry[name]
+        voxelSize = self.voxelSize if voxelSize is None else voxelSize
+        key = metric.getKey(voxelSize)
+
+        if key not in self.derived:
+            self.derived[key] = metric.formula(self, voxelSize)
+
+        return self.derived[key]
+
+    def getDataByColumn(self, column, voxelSize=None):
+        if self.hasMetric(column):
+            return self.getMetric(column, voxelSize)
+        elif column in self.series:
+            return self.series[column]
+        else:
+            return None
+
+class CohortBuilder:
+    def __init__(self, _columns, _grid=None, _dtype=np.float64, _metrics=None):
+        self.columns = list(_columns)
+        self.grid = None if _grid is None else np.asarray(_grid, dtype=float)
+        self.dtype = _dtype
+        self.metrics = _metrics
+        self.labels, self.classNames = [], []
+        self.volume, self.surface, self.length = [], [], []
+        self.sliceCounts = []
+        self.series = dict((column, []) for column in self.columns)
+        self.derived = {}
+        self.reductions = {}
+
+    def add(self, label, className, values, volume=0., surface=0., length=0.):
+        self.labels.append(label)
+        self.classNames.append(className)
+        self.volume.append(volume)
+        self.surface.append(surface)
+        self.length.append(length)
+
+        if self.grid is None:
+            for column in self.columns:
+                self.series[column].append(np.asarray(values[column], dtype=self.dtype))
+            return
+
+        fish = FishCohort.fromSeries([label], [className], dict((column, [values[column]]) for column in self.columns),
+                                     [volume], [surface], [length], dtype=self.dtype).resample(self.grid, self.metrics)
+
+        self.sliceCounts.append(fish.sliceCounts[0])
+
+        for column in self.columns:
+            self.series[column].append(fish.series[column][0])
+
+        for key, value in fish.derived.items():
+            self.derived.setdefault(key, []).append(value[0])
+
+        for key, value in fish.reductions.items():
+            self.reductions.setdefault(key, []).append(value[0])
+
+    def build(self):
+        if self.grid is None:
+            return FishCohort.fromSeries(self.labels, self.classNames, self.series, self.volume, self.surface,
+                                         self.length, dtype=self.dtype)
+
+        classes, classIndex = indexClasses(self.classNames)
+        series = dict((column, np.array(values, dtype=self.dtype).reshape(len(values), len(self.grid)))
+                      for column, values in self.series.items())
+
+        cohort = FishCohort(self.labels, classes, classIndex, np.full(len(self.labels), len(self.grid), dtype=np.intp),
+                            series, self.volume, self.surface, self.length, self.grid, _sliceCounts=self.sliceCounts)
+        cohort.derived = dict((key, np.array(values)) for key, values in self.derived.items())
+        cohort.reductions = dict((key, np.array(values)) for key, values in self.reductions.items())
+
+        return cohort
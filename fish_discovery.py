@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import stat
+import hashlib
+import tempfile
+import collections
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+number = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+statisticsNamePattern = re.compile(r'^(?P<prefix>.+?)_(?P<volume>%s)_(?P<surface>%s)_z(?P<zStart>%s)_z(?P<zEnd>%s)(?:_(?P<fish>.*))?$'
+                                   % (number, number, number, number))
+
+def parseStatisticsFile(fileName):
+    match = statisticsNamePattern.match(os.path.splitext(os.path.basename(fileName))[0])
+
+    if match is None:
+        return None
+
+    zStart, zEnd = float(match.group('zStart')), float(match.group('zEnd'))
+
+    return {
+        'prefix': match.group('prefix'),
+        'fish': match.group('fish'),
+        'volume': float(match.group('volume')),
+        'surface': float(match.group('surface')),
+        'zRange': [zStart, zEnd],
+        'length': zEnd - zStart
+    }
+
+def parseStatisticsName(fileName):
+    parsed = parseStatisticsFile(fileName)
+
+    return (parsed['volume'], parsed['surface'], parsed['length']) if parsed else None
+
+def checkStatisticsFile(parsed):
+    if parsed is None:
+        return 'file name does not match <prefix>_<volume>_<surface>_z<start>_z<end>[_<fish>]'
+
+    if parsed['volume'] <= 0:
+        return 'no volume in file name'
+
+    if parsed['surface'] <= 0:
+        return 'no surface in file name'
+
+    if parsed['zRange'][1] < parsed['zRange'][0]:
+        return 'z-range ends before it starts'
+
+    return None
+
+def createIndexEntry(fishName, files, stamp):
+    entry = {'stamp': stamp, 'file': None, 'duplicates': [], 'error': None}
+    candidates = []
+
+    for fileName in files:
+        parsed = parseStatisticsFile(fileName)
+        error = checkStatisticsFile(parsed)
+        candidates.append(((error is not None, parsed is None or parsed['fish'] != fishName, fileName), parsed, error))
+
+    if not candidates:
+        return entry
+
+    (rank, parsed, error), others = min(candidates), sorted(candidates)[1:]
+    entry.update(file=rank[2], duplicates=[other[0][2] for other in others], error=error)
+
+    if parsed is not None:
+        entry.update(volume=parsed['volume'], surface=parsed['surface'], length=parsed['length'], zRange=parsed['zRange'])
+
+    return entry
+
+def listStatisticsFiles(dataPath, methodPrefix='statistics'):
+    if not os.path.isdir(dataPath):
+        return []
+
+    if scandir is None:
+        return sorted(f for f in os.listdir(dataPath) if f.startswith(methodPrefix) and os.path.isfile(os.path.join(dataPath, f)))
+
+    return sorted(entry.name for entry in scandir(dataPath) if entry.name.startswith(methodPrefix) and entry.is_file())
+
+def findStatisticsFile(dataPath, methodPrefix='statistics'):
+    entry = createIndexEntry(os.path.basename(os.path.normpath(dataPath)), listStatisticsFiles(dataPath, methodPrefix), None)
+
+    return os.path.join(dataPath, entry['file']) if entry['file'] else None
+
+def listFishDirectories(statisticsDir):
+    if scandir is None:
+        return sorted(f for f in os.listdir(statisticsDir) if os.path.isdir(os.path.join(statisticsDir, f)))
+
+    return sorted(entry.name for entry in scandir(statisticsDir) if entry.is_dir())
+
+class FishIndex:
+    def __init__(self, _statisticsDir, _methodPrefix='statistics', _indexDir=None):
+        self.statisticsDir = _statisticsDir
+        self.methodPrefix = _methodPrefix
+        self.indexPath = None
+        self.entries = {}
+        self.changed = False
+
+        if _indexDir:
+            key = '%s|%s' % (os.path.abspath(self.statisticsDir), self.methodPrefix)
+            self.indexPath = os.path.join(_indexDir, 'fish-index-%s.json' % hashlib.sha1(key.encode('utf-8')).hexdigest()[:12])
+
+            if not os.path.exists(_indexDir):
+                os.makedirs(_indexDir)
+
+            if os.path.exists(self.indexPath):
+                try:
+                    with open(self.indexPath) as fp:
+                        self.entries = json.load(fp)
+                except ValueError:
+                    self.entries = {}
+
+    def getEntry(self, fishName):
+        dataPath = os.path.join(self.statisticsDir, fishName)
+
+        try:
+            st = os.stat(dataPath)
+        except OSError:
+            st = None
+
+        if st is None or not stat.S_ISDIR(st.st_mode):
+            if self.entries.pop(fishName, None) is not None:
+                self.changed = True
+
+            return None
+
+        entry = self.entries.get(fishName)
+
+        if entry is None or entry['stamp'] != repr(st.st_mtime):
+            entry = createIndexEntry(fishName, listStatisticsFiles(dataPath, self.methodPrefix), repr(st.st_mtime))
+            self.entries[fishName] = entry
+            self.changed = True
+
+        return entry
+
+    def resolve(self, fishNames, concurrency=1):
+        fishNames = list(fishNames)
+
+        if concurrency > 1 and len(fishNames) > 1:
+            pool = ThreadPool(min(concurrency, len(fishNames)))
+
+            try:
+                entries = pool.map(self.getEntry, fishNames)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            entries = [self.getEntry(fishName) for fishName in fishNames]
+
+        if self.changed and self.indexPath:
+            self.save()
+
+        return dict(zip(fishNames, entries))
+
+    def getPath(self, fishName, entry):
+        return os.path.join(self.statisticsDir, fishName, entry['file']) if entry and entry['file'] else None
+
+    def locate(self, fishNames, concurrency=1):
+        entries = self.resolve(fishNames, concurrency)
+        errors = ['%s: %s (%s)' % (fishName, entry['error'], entry['file']) for fishName, entry in sorted(entries.items())
+                  if entry and entry['error']]
+
+        if errors:
+            raise ValueError('Invalid statistics files in %s:\n  %s' % (self.statisticsDir, '\n  '.join(errors)))
+
+        return dict((fishName, (self.getPath(fishName, entry), (entry['volume'], entry['surface'], entry['length']))
+                     if entry and entry['file'] else None) for fishName, entry in entries.items())
+
+    def save(self):
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(self.indexPath), suffix='.tmp')
+
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(self.entries, fp, sort_keys=True)
+
+        os.rename(tmpPath, self.indexPath)
+        self.changed = False
+
+def discoverStatistics(statisticsDir, fishNames, methodPrefix='statistics', concurrency=1):
+    index = FishIndex(statisticsDir, methodPrefix)
+
+    return dict((fishName, index.getPath(fishName, entry)) for fishName, entry in index.resolve(fishNames, concurrency).items())
+
+def prefetch(items, reader, concurrency=1):
+    if concurrency <= 1:
+        for item in items:
+            yield reader(item)
+        return
+
+    pool = ThreadPool(concurrency)
+    pending = collections.deque()
+
+    try:
+        for item in items:
+            pending.append(pool.apply_async(reader, (item,)))
+
+            if len(pending) > 2 * concurrency:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
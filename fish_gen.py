@@ -1,11 +1,10 @@
 import os
 import sys
-import csv
-import operator
+import multiprocessing
 import numpy as np
 
 class FishMaker:
-	def __init__(self, _fishNumbers=[], _statColumns=[], _fishPrefix='fish', _numSlices=50, _sigma=5.5, _mu=10):
+	def __init__(self, _fishNumbers=[], _statColumns=[], _fishPrefix='fish', _numSlices=50, _sigma=5.5, _mu=10, _seed=None, _sliceRange=None):
 		if _fishNumbers:
 			self.fishNumbers = _fishNumbers
 		else:
@@ -20,23 +19,100 @@ class FishMaker:
 		self.sigma = _sigma
 		self.mu = _mu
 		self.fishPrefix = _fishPrefix
+		self.seed = _seed
+		self.sliceRange = _sliceRange
+		self.statisticsColumns = ['Area', 'Perim.', 'Width', 'Height', 'Feret', 'Breadth', 'CArea', 'MinR', 'MaxR']
 
-	def generate_csv(self, outputDir):
-		for fishNumber in self.fishNumbers:
-			outputPath = os.path.join(outputDir, self.fishPrefix + str(fishNumber))
-			if not os.path.exists(outputPath):
-				os.makedirs(outputPath)
+	def make_rng(self, fishNumber):
+		seed = None if self.seed is None else [self.seed, fishNumber]
 
-			outputFile = "statistics_cross_sections_%s%s_8bit_129x256x256.csv" % (self.fishPrefix, str(fishNumber))
+		if hasattr(np.random, 'default_rng'):
+			return np.random.default_rng(seed)
 
-			scv_file = csv.writer(open(os.path.join(outputPath, outputFile), "w"), delimiter='\t', quoting=csv.QUOTE_ALL)
+		return np.random.RandomState(seed)
 
-			print "%s is generating..." % os.path.join(outputPath, outputFile)
+	def make_statistics(self, rng, numSlices):
+		profile = np.sin(np.linspace(0, np.pi, numSlices + 2)[1:-1])
+		noise = rng.standard_normal(numSlices + 1)
+		uniform = rng.uniform(size=(3, numSlices))
 
-			scv_file.writerow(self.statColumns)
+		radius = np.abs(profile * (self.mu * 4 + self.sigma * noise[0]) + self.sigma * 0.1 * noise[1:]) + 1
+		elongation = 1 + 0.2 * uniform[0]
 
-			for sliceIdx in range(self.numSlices):
-				scv_file.writerow(reduce(operator.add, [[sliceIdx], [self.sigma * np.random.randn() + self.mu for _ in range(len(self.statColumns) - 1)]]))
+		width = 2 * radius * elongation
+		height = 2 * radius / elongation
+		area = np.pi * radius ** 2
+		perim = np.pi * (width + height) / 2 * (1 + 0.05 * uniform[1])
+		feret = np.maximum(width, height)
+		breadth = np.minimum(width, height)
+		carea = area * (1 + 0.1 * uniform[2])
+
+		return np.column_stack([np.arange(1, numSlices + 1), area, perim, width, height, feret, breadth, carea, radius / elongation, radius * elongation])
+
+	def write_statistics(self, outputDir, fishNumber):
+		rng = self.make_rng(fishNumber)
+		fishName = self.fishPrefix + str(fishNumber)
+		outputPath = os.path.join(outputDir, fishName)
+		if not os.path.exists(outputPath):
+			os.makedirs(outputPath)
+
+		bounds = rng.uniform(size=2)
+		numSlices = int(self.sliceRange[0] + bounds[0] * (self.sliceRange[1] - self.sliceRange[0] + 1)) if self.sliceRange else self.numSlices
+		zStart = int(1 + bounds[1] * 99)
+		data = self.make_statistics(rng, numSlices)
+
+		outputFile = "statistics_%.2f_%.2f_z%d_z%d_%s.csv" % (data[:, 1].sum(), data[:, 2].sum(), zStart, zStart + numSlices, fishName)
+
+		np.savetxt(os.path.join(outputPath, outputFile), data, fmt=['%d'] + ['%.6f'] * len(self.statisticsColumns),
+			delimiter=';', header=';'.join([' '] + self.statisticsColumns), comments='')
+
+		return os.path.join(outputPath, outputFile)
+
+	def write_csv(self, outputDir, fishNumber):
+		rng = self.make_rng(fishNumber)
+		outputPath = os.path.join(outputDir, self.fishPrefix + str(fishNumber))
+		if not os.path.exists(outputPath):
+			os.makedirs(outputPath)
+
+		outputFile = "statistics_cross_sections_%s%s_8bit_129x256x256.csv" % (self.fishPrefix, str(fishNumber))
+
+		data = self.sigma * rng.standard_normal((self.numSlices, len(self.statColumns) - 1)) + self.mu
+		data = np.column_stack([np.arange(self.numSlices), data])
+
+		np.savetxt(os.path.join(outputPath, outputFile), data, fmt=['"%d"'] + ['"%.17g"'] * (len(self.statColumns) - 1),
+			delimiter='\t', header='\t'.join('"%s"' % c for c in self.statColumns), comments='', newline='\r\n')
+
+		return os.path.join(outputPath, outputFile)
+
+	def generate(self, method, outputDir, processes=1):
+		tasks = [(self, method, outputDir, fishNumber) for fishNumber in self.fishNumbers]
+
+		if processes == 1 or len(tasks) < 2:
+			return [generate_fish(task) for task in tasks]
+
+		pool = multiprocessing.Pool(processes)
+
+		try:
+			return pool.map(generate_fish, tasks, chunksize=max(1, len(tasks) // (4 * (processes or multiprocessing.cpu_count()))))
+		finally:
+			pool.close()
+			pool.join()
+
+	def generate_statistics(self, outputDir, processes=1):
+		return self.generate('write_statistics', outputDir, processes)
+
+	def generate_csv(self, outputDir, processes=1):
+		paths = self.generate('write_csv', outputDir, processes)
+
+		for path in paths:
+			print("%s is generated." % path)
+
+		return paths
+
+def generate_fish(task):
+	fishMaker, method, outputDir, fishNumber = task
+
+	return getattr(fishMaker, method)(outputDir, fishNumber)
 
 def main():
 	fishMaker = FishMaker()
@@ -0,0 +1,85 @@
+import numpy as np
+
+def sumSlices(values):
+    return np.nansum(values, axis=1)
+
+def maxSlices(values):
+    return np.nanmax(values, axis=1)
+
+def countSlices(values):
+    return np.sum(~np.isnan(values), axis=1)
+
+reductions = {
+    'sum': sumSlices,
+    'max': maxSlices,
+    'count': countSlices
+}
+
+class Metric:
+    def __init__(self, _name, _columns, _formula, _scalar=False, _scaled=False, _reductions=()):
+        self.name = _name
+        self.columns = tuple(_columns)
+        self.formula = _formula
+        self.scalar = _scalar
+        self.scaled = _scaled
+        self.reductions = tuple(_reductions)
+
+    def getKey(self, voxelSize):
+        return (self.name, tuple(float(v) for v in voxelSize)) if self.scaled else self.name
+
+def getArea(fish, voxelSize):
+    scale = np.where(fish.volume > 0, fish.volume, 1.)
+
+    return fish.series['Area'] / scale[:, np.newaxis]
+
+def getCircularity(fish, voxelSize):
+    return 2.0*np.sqrt(fish.getMetric('Area', voxelSize)) / fish.series['Perim.']
+
+def getSolidity(fish, voxelSize):
+    return fish.series['Area'] / fish.series['CArea']
+
+def getRoundness(fish, voxelSize):
+    return 4.0*fish.series['Area'] / (np.pi * fish.series['Feret'] ** 2)
+
+def getAspRatio(fish, voxelSize):
+    return fish.series['Feret'] / fish.series['Breadth']
+
+def getVolume(fish, voxelSize):
+    return np.where(fish.volume > 0, fish.volume, fish.getReduction('sum', 'Area') * voxelSize[0] * voxelSize[1] * voxelSize[2])
+
+def getSurface(fish, voxelSize):
+    return np.where(fish.surface > 0, fish.surface, fish.getReduction('sum', 'Perim.') * voxelSize[0] * voxelSize[2])
+
+def getLength(fish, voxelSize):
+    return np.where(fish.length > 0, fish.length, fish.getReduction('count', 'Area') * voxelSize[2])
+
+def getWidth(fish, voxelSize):
+    return fish.getReduction('max', 'Width')
+
+def getHeight(fish, voxelSize):
+    return fish.getReduction('max', 'Height')
+
+metricRegistry = dict((metric.name, metric) for metric in [
+    Metric('Area', ('Area',), getArea),
+    Metric('Circularity', ('Area', 'Perim.'), getCircularity),
+    Metric('Solidity', ('Area', 'CArea'), getSolidity),
+    Metric('Roundness', ('Area', 'Feret'), getRoundness),
+    Metric('AspRatio', ('Feret', 'Breadth'), getAspRatio),
+    Metric('Volume', ('Area',), getVolume, _scalar=True, _scaled=True, _reductions=[('sum', 'Area')]),
+    Metric('Surface', ('Perim.',), getSurface, _scalar=True, _scaled=True, _reductions=[('sum', 'Perim.')]),
+    Metric('Length', ('Area',), getLength, _scalar=True, _scaled=True, _reductions=[('count', 'Area')]),
+    Metric('Width', ('Width',), getWidth, _scalar=True, _reductions=[('max', 'Width')]),
+    Metric('Height', ('Height',), getHeight, _scalar=True, _reductions=[('max', 'Height')])
+])
+
+def getRequiredColumns(metrics):
+    columns = []
+
+    for name in metrics:
+        metric = metricRegistry.get(name.strip())
+
+        for column in metric.columns if metric else ():
+            if column not in columns:
+                columns.append(column)
+
+    return columns or ['Area']
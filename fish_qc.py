@@ -0,0 +1,127 @@
+import json
+import warnings
+import numpy as np
+
+from fish_cohort import makeGrid
+
+def robustZScores(values, axis=0):
+    values = np.asarray(values, dtype=float)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        median = np.nanmedian(values, axis=axis, keepdims=True)
+        deviation = np.abs(values - median)
+        scale = 1.4826 * np.nanmedian(deviation, axis=axis, keepdims=True)
+        scale = np.where(scale > 0, scale, 1.2533 * np.nanmean(deviation, axis=axis, keepdims=True))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (values - median) / scale
+
+    z[deviation == 0] = 0
+
+    return z
+
+def classZScores(values, classIndex):
+    z = np.zeros(np.shape(values))
+
+    for classIdx in np.unique(classIndex):
+        rows = classIndex == classIdx
+        z[rows] = robustZScores(values[rows], axis=0)
+
+    return z
+
+def toNumber(value):
+    return float(value) if np.isfinite(value) else None
+
+def runQualityChecks(cohort, metrics, columns, threshold=3.5, sliceFraction=0.1, voxelSize=None):
+    count = len(cohort)
+    width = max(values.shape[1] for values in cohort.series.values()) if cohort.series else 0
+    valid = np.arange(width)[np.newaxis, :] < cohort.lengths[:, np.newaxis]
+    noSlices = np.zeros((count, width), dtype=bool)
+
+    with np.errstate(invalid='ignore'):
+        zeroArea = valid & (cohort.series['Area'] <= 0) if 'Area' in cohort.series else noSlices
+        nanPerimeter = valid & np.isnan(cohort.series['Perim.']) if 'Perim.' in cohort.series else noSlices
+
+    missingColumns = [column for column in columns if column not in cohort.series]
+    emptyColumns = dict((column, ~np.any(valid & ~np.isnan(cohort.series[column]), axis=1))
+                        for column in columns if column in cohort.series)
+    lengthZ = classZScores(cohort.sliceCounts, cohort.classIndex)
+    truncated = (cohort.length > 0) & (cohort.sliceCounts < (1 - sliceFraction) * cohort.length)
+
+    aligned = cohort.resample(makeGrid(1), metrics) if cohort.grid is None else cohort
+    outliers = {}
+
+    for metric in metrics:
+        values = aligned.getDataByColumn(metric, voxelSize)
+
+        if values is not None and values.ndim == 2:
+            with np.errstate(invalid='ignore'):
+                outliers[metric] = np.abs(classZScores(values, aligned.classIndex)) > threshold
+
+    anyOutlier = np.any(list(outliers.values()), axis=0) if outliers else np.zeros((count, len(aligned.grid)), dtype=bool)
+    outlierFraction = anyOutlier.mean(axis=1) if anyOutlier.shape[1] else np.zeros(count)
+    brokenFraction = (zeroArea | nanPerimeter).sum(axis=1) / np.maximum(cohort.lengths, 1).astype(float)
+
+    fishes = []
+
+    for i, label in enumerate(cohort.labels):
+        reasons = ['missing %s' % column for column in columns if column in missingColumns or emptyColumns[column][i]]
+
+        if not cohort.sliceCounts[i]:
+            reasons.append('no slices')
+        elif abs(lengthZ[i]) > threshold:
+            reasons.append('slice count z=%.1f' % lengthZ[i])
+
+        if truncated[i]:
+            reasons.append('truncated stack: %d of %d slices' % (cohort.sliceCounts[i], cohort.length[i]))
+
+        if brokenFraction[i] > sliceFraction:
+            reasons.append('%.0f%% slices with zero area or NaN perimeter' % (100 * brokenFraction[i]))
+
+        if outlierFraction[i] > sliceFraction:
+            reasons.append('%.0f%% outlier slices' % (100 * outlierFraction[i]))
+
+        fishes.append({
+            'label': label,
+            'class': cohort.classes[cohort.classIndex[i]],
+            'slices': int(cohort.sliceCounts[i]),
+            'lengthZ': toNumber(lengthZ[i]),
+            'zeroAreaSlices': np.flatnonzero(zeroArea[i]).tolist(),
+            'nanPerimeterSlices': np.flatnonzero(nanPerimeter[i]).tolist(),
+            'outlierSlices': dict((metric, aligned.grid[mask[i]].tolist()) for metric, mask in outliers.items() if mask[i].any()),
+            'outlierFraction': float(outlierFraction[i]),
+            'reasons': reasons,
+            'flagged': bool(reasons),
+            'excluded': False
+        })
+
+    return {
+        'threshold': threshold,
+        'sliceFraction': sliceFraction,
+        'gridPoints': None if cohort.grid is None else len(cohort.grid),
+        'metrics': sorted(outliers),
+        'missingColumns': missingColumns,
+        'checked': count,
+        'flagged': sum(1 for fish in fishes if fish['flagged']),
+        'excluded': 0,
+        'fish': fishes
+    }
+
+def excludeFlagged(cohort, report):
+    keep = []
+
+    for i, fish in enumerate(report['fish']):
+        if fish['flagged']:
+            fish['excluded'] = True
+        else:
+            keep.append(i)
+
+    report['excluded'] = len(report['fish']) - len(keep)
+
+    return cohort.select(keep)
+
+def writeQcReport(path, report):
+    with open(path, 'w') as fp:
+        json.dump(report, fp, indent=2, sort_keys=True)
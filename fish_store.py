@@ -0,0 +1,187 @@
+import os
+import json
+import uuid
+import shutil
+import tempfile
+import numpy as np
+
+import pandas as pd
+
+from data_cache import readStatistics
+from fish_cohort import FishCohort
+from fish_discovery import FishIndex, listFishDirectories, prefetch
+
+metaColumns = ['Label', 'Class', 'Volume', 'Surface', 'Length', 'VoxelX', 'VoxelY', 'VoxelZ', 'Source']
+
+class FishStore:
+    def __init__(self, _storeDir):
+        self.storeDir = _storeDir
+
+        with open(os.path.join(self.storeDir, 'store.json')) as fp:
+            self.manifest = json.load(fp)
+
+        self.storeId = self.manifest['id']
+        self.columns = self.manifest['columns']
+        self.offsets = np.load(os.path.join(self.storeDir, 'offsets.npy'))
+        self.meta = pd.read_csv(os.path.join(self.storeDir, 'fish.csv'), sep=';', keep_default_na=False,
+                                dtype={'Label': str, 'Class': str, 'Source': str})
+        self.index = dict((fishName, i) for i, fishName in enumerate(self.meta['Label']))
+        self.arrays = {}
+
+    def __contains__(self, fishName):
+        return fishName in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def getColumn(self, column):
+        if column not in self.arrays:
+            path = os.path.join(self.storeDir, 'column%d.npy' % self.columns.index(column))
+            self.arrays[column] = np.load(path, mmap_mode='r')
+
+        return self.arrays[column]
+
+    def getSeries(self, fishName, column):
+        i = self.index[fishName]
+
+        return self.getColumn(column)[self.offsets[i]:self.offsets[i + 1]]
+
+    def getMeta(self, fishName):
+        i = self.index[fishName]
+
+        return tuple(float(self.meta[column].values[i]) for column in ('Volume', 'Surface', 'Length'))
+
+    def getSource(self, fishName):
+        return self.meta['Source'].values[self.index[fishName]]
+
+    def getVoxelSize(self, fishNames):
+        rows = self.meta.iloc[[self.index[fishName] for fishName in fishNames]]
+        voxelSizes = set(tuple(row) for row in rows[['VoxelX', 'VoxelY', 'VoxelZ']].values.tolist())
+
+        if len(voxelSizes) > 1:
+            raise ValueError('Fish with different voxel sizes cannot share a cohort: %s' % sorted(voxelSizes))
+
+        return voxelSizes.pop() if voxelSizes else (1, 1, 1)
+
+    def readCohort(self, fishClasses, columns):
+        labels, classNames, meta = [], [], []
+
+        for fishClass, fishNames in fishClasses.items():
+            for fishName in fishNames:
+                if fishName in self.index:
+                    labels.append(fishName)
+                    classNames.append(fishClass)
+                    meta.append(self.getMeta(fishName))
+
+        series = dict((column, [self.getSeries(fishName, column) for fishName in labels])
+                      for column in columns if column in self.columns)
+        volume, surface, length = zip(*meta) if meta else ((), (), ())
+
+        cohort = FishCohort.fromSeries(labels, classNames, series, volume, surface, length)
+        cohort.voxelSize = self.getVoxelSize(labels)
+
+        return cohort
+
+def isStore(path):
+    return os.path.isfile(os.path.join(path, 'store.json'))
+
+def checkStoreDir(storeDir):
+    if os.path.exists(storeDir) and not isStore(storeDir):
+        raise ValueError('%s exists and is not a fish store; only an existing store is replaced' % storeDir)
+
+class StoreWriter:
+    def __init__(self, _storeDir):
+        checkStoreDir(_storeDir)
+
+        self.storeDir = _storeDir
+        self.parentDir = os.path.dirname(os.path.abspath(self.storeDir))
+        self.tmpDir = tempfile.mkdtemp(dir=self.parentDir, prefix='.fish-store-')
+        self.columns = []
+        self.files = []
+        self.offsets = [0]
+        self.rows = []
+
+    def addColumn(self, column):
+        self.columns.append(column)
+        fp = open(os.path.join(self.tmpDir, 'column%d.raw' % (len(self.columns) - 1)), 'wb')
+        np.full(self.offsets[-1], np.nan).tofile(fp)
+        self.files.append(fp)
+
+    def add(self, fishName, fishClass, dataFrame, meta, voxelSize, source):
+        numeric = [column for column in dataFrame.columns if np.issubdtype(dataFrame[column].dtype, np.number)]
+
+        for column in numeric:
+            if column not in self.columns:
+                self.addColumn(column)
+
+        for column, fp in zip(self.columns, self.files):
+            if column in numeric:
+                dataFrame[column].values.astype(np.float64).tofile(fp)
+            else:
+                np.full(len(dataFrame), np.nan).tofile(fp)
+
+        self.offsets.append(self.offsets[-1] + len(dataFrame))
+        self.rows.append([fishName, fishClass] + list(meta) + list(voxelSize) + [source])
+
+    def close(self):
+        rowCount = self.offsets[-1]
+
+        for i, fp in enumerate(self.files):
+            fp.close()
+            rawPath = os.path.join(self.tmpDir, 'column%d.raw' % i)
+            column = np.lib.format.open_memmap(os.path.join(self.tmpDir, 'column%d.npy' % i), 'w+', np.float64, (rowCount,))
+
+            if rowCount:
+                column[:] = np.memmap(rawPath, np.float64, 'r', shape=(rowCount,))
+
+            column.flush()
+            del column
+            os.remove(rawPath)
+
+        np.save(os.path.join(self.tmpDir, 'offsets.npy'), np.array(self.offsets, dtype=np.int64))
+        pd.DataFrame(self.rows, columns=metaColumns).to_csv(os.path.join(self.tmpDir, 'fish.csv'), sep=';', index=False)
+
+        with open(os.path.join(self.tmpDir, 'store.json'), 'w') as fp:
+            json.dump({'id': uuid.uuid4().hex, 'columns': self.columns, 'fish': len(self.rows), 'rows': rowCount}, fp, indent=2)
+
+        checkStoreDir(self.storeDir)
+
+        if os.path.exists(self.storeDir):
+            shutil.rmtree(self.storeDir)
+
+        os.rename(self.tmpDir, self.storeDir)
+
+    def abort(self):
+        for fp in self.files:
+            fp.close()
+
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+def ingestStatistics(statisticsDir, storeDir, fishClasses=None, methodPrefix='statistics', voxelSize=(1, 1, 1),
+                     ioWorkers=1, cache=None):
+    storePath = os.path.join(os.path.realpath(storeDir), '')
+
+    if os.path.join(os.path.realpath(statisticsDir), '').startswith(storePath):
+        raise ValueError('Store directory %s must not be or contain the statistics directory %s' % (storeDir, statisticsDir))
+
+    if fishClasses is None:
+        fishClasses = {'': listFishDirectories(statisticsDir)}
+
+    fishes = [(fishClass, fishName) for fishClass, fishNames in fishClasses.items() for fishName in fishNames]
+    index = FishIndex(statisticsDir, methodPrefix, cache.cacheDir if cache is not None else None)
+    files = index.locate([fishName for fishClass, fishName in fishes], ioWorkers)
+    sources = [(fishClass, fishName) + files[fishName] for fishClass, fishName in fishes if files[fishName]]
+    read = lambda source: readStatistics(source[2], ';', cache)
+
+    writer = StoreWriter(storeDir)
+
+    try:
+        for (fishClass, fishName, sourceFile, meta), (dataFrame, nameMeta) in zip(sources, prefetch(sources, read, ioWorkers)):
+            writer.add(fishName, fishClass, dataFrame, meta, voxelSize, os.path.relpath(sourceFile, statisticsDir))
+
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    return FishStore(storeDir)
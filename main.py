@@ -1,162 +1,343 @@
 import os
 import sys
 import ast
-import matplotlib.pyplot as plt
-import numpy as np
-from io import BytesIO
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch, cm
-from reportlab.lib.utils import ImageReader
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.rl_config import defaultPageSize
-import pandas as pd
-from pandas import DataFrame
-
-PAGE_HEIGHT=defaultPageSize[1]
-PAGE_WIDTH=defaultPageSize[0]
-styles = getSampleStyleSheet()
-
-pathToStatistics = "/Users/Roman/Documents/testtest_result"
-methodPrefix = "statistics"
-typeOfData = "cross_sections"
-
-mainTitleText = "Medaka's report"
-
-args = ast.literal_eval(sys.argv[1])
-
-print ', '.join(args.keys())
-
-subTitleText = "Comparison of phenotypes form %s classes" % (', '.join(["'%s'" % k for k in args.keys()]))
-
-metricsInfo = {
-    'CSIndex': 'Index if the current cross-section.',
-    'Slice': 'Slice number in the stack.',
-    'Number': 'Blob number in the slice.',
-    'XStart': 'The x coordinate of the first scanned point in the particle.',
-    'YStart': 'The y coordinate of the first scanned point in the particle.',
-    'Perim': 'The Perimeter, calculated from the centres of the boundary pixles.',
-    'Area': 'The Area inside the polygon defined by the Perimeter.',
-    'Pixels': 'The number of pixels forming the blob.',
-    'XM': 'X coordinate of the centre of mass or momentum.',
-    'YM': 'Y coordinate of the centre of mass or momentum.',
-    'ROIX1': 'X coordinate of the top-left corner of the ROI that encloses the particle.',
-    'ROIY1': 'Y coordinate of the top-left corner of the ROI that encloses the particle.',
-    'ROIX2': 'X coordinate of the bottom-right corner of the ROI that encloses the particle.',
-    'ROIY2': 'Y coordinate of the bottom-right corner of the ROI that encloses the particle.',
-    'MinR': 'Radius of the inscribed circle centred at the centre of mass.',
-    'MaxR': 'Radius of the enclosing circle centred at the centre of mass.',
-    'Feret': 'Largest axis length.',
-    'FeretX1': 'X coordinate of the first point of the Feret.',
-    'FeretY1': 'Y coordinate of the first point of the Feret.',
-    'FeretX2': 'X coordinate of the second point of the Feret.',
-    'FeretY2': 'Y coordinate of the second point of the Feret.',
-    'FAngle': 'Angle (in degrees) of the Feret with the horizontal (0..180).',
-    'Breadth': 'The largest axis perpendicular to the Feret (not necessarily colinear).',
-    'BrdthX1': 'X coordinate of the first Breadth point.',
-    'BrdthY1': 'Y coordinate of the first Breadth point.',
-    'BrdthX2': 'X coordinate of the second Breadth point.',
-    'BrdthY2': 'Y coordinate of the second Breadth point.',
-    'CHull': 'Convex Hull or convex polygon calculated from pixel centres. (This value is the same as the perimeter only for rectangular particles).',
-    'CArea': 'Area of the Convex Hull polygon.',
-    'MBCX': 'X coordinate of the Minimal Bounding Circle centre.',
-    'MBCY': 'Y coordinate of the Minimal Bounding Circle centre.',
-    'MBCRadius': 'Radius of the Minimal Bounding Circle.',
-    'CountCorrect': 'This is a correction factor for unbiased counting of particles calculated as CountCorrect=XY/(X-Fx)(Y-Fy), where X and Y are the width and height of the ROI and Fx and Fy are the maximum projected dimensions of the object in the X and Y axes (this is Fx=1+ROIX2-ROIX1 and Fy=1+ROIY2-ROIY1 respectively). This correction factor should be applied with data generated with "exclude edge particles" checked.',
-    'AspRatio': 'Aspect Ratio = Feret/Breadth.',
-    'Circ': 'Circularity = 4*Pi*Area/Perimeter2, sometimes called Form Factor or Thinnes ratio. Note that the value is slightly different from that calculated using the built-in Particle Analyzer because of the way the particle area is estimated.',
-    'Roundness': 'Roundness = 4*Area/(Pi*Feret2).',
-    'AreaEquivD': 'Area Equivalent Diameter = sqrt((4/Pi)*Area).',
-    'PerimEquivD': 'Perimeter Equivalent Diameter = Area/Pi.',
-    'EquivEllipseAr': 'Equivalent Ellipse Area = (Pi*Feret*Breadth)/4, this is the area of an ellipse with the same long and short axes as the particle.',
-    'Compactness': 'Compactness = sqrt((4/Pi)*Area)/Feret or alternatively ArEquivD/Feret.',
-    'Solidity': 'Solidity = Area/Convex_Area.',
-    'Concavity': 'Concavity = Convex_Area-Area.',
-    'Convexity': 'Convexity = Convex_Hull/Perimeter.',
-    'Shape': 'Shape = Perimeter2/Area.',
-    'RFactor': 'RFactor = Convex_Hull /(Feret*Pi).',
-    'ModRatio': 'Modification Ratio = (2*MinR)/Feret.',
-    'Sphericity': 'Sphericity = MinR/MaxR.',
-    'ArBBox': 'ArBBox = Feret*Breadth. This is the area of the Bounding Box along the Feret diameter, but it is not necessarily the minimal bounding box! (Search the net for "rotating calipers algorithm").',
-    'Rectang': 'Rectangularity = Area/ArBBox. This approaches 0 for cross-like objects, 0.5 for squares, pi/4=0.79 for circles and approaches 1 for long rectangles.'
-}
-
-def titlePage(canvas, doc):
-    canvas.saveState()
-    canvas.setFont('Times-Bold',32)
-    canvas.drawCentredString(PAGE_WIDTH/2.0, PAGE_HEIGHT-108, mainTitleText)
-    canvas.setFont('Times-Bold',16)
-    canvas.drawCentredString(PAGE_WIDTH/2.0, PAGE_HEIGHT-130, subTitleText)
-    canvas.restoreState()
-
-def regularPage(canvas, doc):
-    canvas.saveState()
-    canvas.setFont('Times-Roman',9)
-    canvas.drawString(inch, 0.75 * inch, "%d" % (doc.page))
-    canvas.restoreState()
-
-def createPlotWithCol(dataFrames, column, args, doc):
-    fig = plt.figure(figsize=(10, 4))
-    ax = fig.add_subplot(111)
-
-    for fishClass, fishNames in args.items():
+import argparse
+
+def parseClasses(text):
+    try:
+        classes = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        raise argparse.ArgumentTypeError('not a class dictionary: %s' % text)
+
+    if not isinstance(classes, dict) or not all(isinstance(fishNames, (list, tuple)) for fishNames in classes.values()):
+        raise argparse.ArgumentTypeError("expected {'Class': ['fish1', ...], ...}, got: %s" % text)
+
+    return classes
+
+def parseList(text):
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+def parseTests(text):
+    tests = parseList(text)
+    unknown = [test for test in tests if test not in ('welch', 'mannwhitney', 'permutation')]
+
+    if unknown:
+        raise argparse.ArgumentTypeError('unknown test %s, expected welch, mannwhitney or permutation' % ', '.join(unknown))
+
+    return tests
+
+def parseFishNumbers(text):
+    numbers = []
+
+    for item in parseList(text):
+        if '-' in item:
+            first, last = item.split('-', 1)
+            numbers.extend(range(int(first), int(last) + 1))
+        else:
+            numbers.append(int(item))
+
+    return numbers
+
+def parseVoxelSize(text):
+    try:
+        voxelSize = [float(item) for item in parseList(text)]
+    except ValueError:
+        voxelSize = []
+
+    if len(voxelSize) != 3:
+        raise argparse.ArgumentTypeError('expected three comma-separated sizes, got: %s' % text)
+
+    return voxelSize
+
+def discover(options):
+    from fish_discovery import discoverStatistics
+
+    fishNames = [fishName for fishNames in options.classes.values() for fishName in fishNames]
+
+    if getattr(options, 'store', None):
+        from fish_store import FishStore
+
+        store = FishStore(options.store)
+
+        return dict((fishName, '%s:%s' % (options.store, store.getSource(fishName)) if fishName in store else None)
+                    for fishName in fishNames)
+
+    if not os.path.isdir(options.statistics_dir):
+        return {}
+
+    return discoverStatistics(options.statistics_dir, fishNames, options.method_prefix, options.io_workers)
+
+def printPlan(options, output):
+    files = discover(options)
+
+    print('statistics: %s' % options.statistics_dir)
+    print('output: %s' % output)
+    print('metrics: %s' % ', '.join(options.stats))
+
+    for fishClass, fishNames in options.classes.items():
+        print('%s:' % fishClass)
+
         for fishName in fishNames:
-            dataFrames[fishName][column].plot(label=fishName)
+            print('  %s: %s' % (fishName, files.get(fishName) or 'missing'))
+
+    return 0
+
+def runReport(options):
+    if options.dry_run:
+        return printPlan(options, options.output)
+
+    from report_gen import FishReport
+
+    report = FishReport(repr(options.classes), options.statistics_dir, options.method_prefix, options.title, options.output,
+                        options.stats, options.workers, options.cache_dir, options.plot_store, options.grid_step,
+                        options.plot_mode, _significance=options.significance, _streaming=options.streaming,
+                        _ioWorkers=options.io_workers, _plotFormat=options.format, _traceFile=options.trace,
+                        _traceFormat=options.trace_format, _traceAppendix=options.trace_appendix, _comparison=options.compare,
+                        _alpha=options.alpha, _permutations=options.permutations, _comparisonWorkers=options.compare_workers,
+                        _comparisonDir=options.compare_dir, _storeDir=options.store, _fishPages=options.fish_pages or None,
+                        _shardBy=options.shard_by, _shardWorkers=options.shard_workers, _qc=options.qc, _qcThreshold=options.qc_threshold,
+                        _qcSliceFraction=options.qc_slice_fraction, _qcExclude=options.qc_exclude, _qcFile=options.qc_file,
+                        _voxelSize=options.voxel_size)
+    report.generate()
+
+    return 0
+
+def runSpreadsheet(options):
+    if options.dry_run:
+        return printPlan(options, options.output)
+
+    from data_concatenator import FishDataConcatenator
+
+    concatenator = FishDataConcatenator(repr(options.classes), options.statistics_dir, options.output, options.method_prefix,
+                                        options.stats, options.cache_dir, options.format, options.grid_step,
+                                        options.io_workers, options.trace, options.trace_format, options.store)
+    concatenator.generateSpreadsheets()
+
+    return 0
 
-    plt.legend(loc="upper right")
-    plt.xlabel('Number of slice (%)')
-    plt.ylabel('Units')
-    plt.grid(True)
-    plt.tight_layout()
+def runGenerate(options):
+    from fish_gen import FishMaker
 
-    imgdata = BytesIO()
-    fig.savefig(imgdata, format='png')
-    imgdata.seek(0)
-    img = Image(imgdata)
-    img._restrictSize(doc.width, doc.height*0.3)
+    maker = FishMaker(options.fish, _seed=options.seed, _sliceRange=(options.min_slices, options.max_slices))
 
-    return img
+    if options.csv:
+        maker.generate_csv(options.output_dir, options.processes or None)
+    else:
+        maker.generate_statistics(options.output_dir, options.processes or None)
 
-def readDataFrames(inputPath, fishClasses):
-    dataFrames = {}
-    cols = []
+    return 0
 
-    for fishClass, fishNames in args.items():
+def runBatch(options):
+    from report_batch import ReportBatch, readManifest
+
+    specs = readManifest(options.manifest)
+
+    if options.dry_run:
+        for spec in specs:
+            print('%s: %s' % (spec['docName'], ', '.join(sorted(spec['classes']))))
+
+        return 0
+
+    batch = ReportBatch(specs, options.statistics_dir, options.workers, options.method_prefix, options.cache_dir,
+                        options.io_workers, options.streaming, options.store)
+
+    for docName in batch.generate():
+        print(docName)
+
+    return 0
+
+def runIngest(options):
+    from data_cache import FishDataCache
+    from fish_store import ingestStatistics
+
+    store = ingestStatistics(options.statistics_dir, options.store_dir, options.classes, options.method_prefix,
+                             options.voxel_size, options.io_workers, FishDataCache(options.cache_dir) if options.cache_dir else None)
+
+    print('%s: %d fish, %d slices, %d columns' % (options.store_dir, len(store), store.offsets[-1], len(store.columns)))
+
+    return 0
+
+def runServe(options):
+    from report_server import ReportServer
+
+    server = ReportServer(options.statistics_dir, options.workers, options.queue_size, options.method_prefix, options.io_workers,
+                          options.data_cache_mb * 1024 * 1024, options.plot_cache_mb * 1024 * 1024)
+
+    try:
+        server.serve(options.host, options.port, options.socket)
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+def runValidate(options):
+    from fish_discovery import FishIndex
+    from fish_metrics import getRequiredColumns
+
+    errors = []
+    warnings = []
+    seen = {}
+
+    for fishClass, fishNames in options.classes.items():
         for fishName in fishNames:
-            dataPath = os.path.join(inputPath, fishName)
-            files = [f for f in os.listdir(dataPath) if os.path.isfile(os.path.join(dataPath,f)) and f.startswith(methodPrefix + '_' + typeOfData)]
+            if fishName in seen:
+                errors.append('%s is listed in both %s and %s' % (fishName, seen[fishName], fishClass))
+
+            seen[fishName] = fishClass
+
+    index = FishIndex(options.statistics_dir, options.method_prefix)
+
+    if not os.path.isdir(options.statistics_dir):
+        errors.append('statistics directory does not exist: %s' % options.statistics_dir)
+        entries = {}
+    else:
+        entries = index.resolve(sorted(seen), options.io_workers)
+
+    required = getRequiredColumns(options.stats)
+
+    for fishName in sorted(seen):
+        entry = entries.get(fishName)
+        path = index.getPath(fishName, entry)
+
+        if not path:
+            errors.append('%s: no %s* file found' % (fishName, options.method_prefix))
+            continue
+
+        if entry['error']:
+            errors.append('%s: %s (%s)' % (fishName, entry['error'], entry['file']))
+
+        if entry['duplicates']:
+            warnings.append('%s: using %s, ignoring %s' % (fishName, entry['file'], ', '.join(entry['duplicates'])))
+
+        with open(path) as fp:
+            header = [column.strip() for column in fp.readline().rstrip('\r\n').split(';')]
+
+        missing = [column for column in required if column not in header]
+
+        if missing:
+            errors.append('%s: missing columns %s' % (fishName, ', '.join(missing)))
+
+    for message in warnings:
+        print('warning: %s' % message)
+
+    for message in errors:
+        print('error: %s' % message)
+
+    print('%d fish, %d errors, %d warnings' % (len(seen), len(errors), len(warnings)))
+
+    return 1 if errors else 0
+
+def addInputArguments(parser):
+    parser.add_argument('classes', type=parseClasses, help="class dictionary, e.g. \"{'Wild': ['fish200', 'fish202']}\"")
+    parser.add_argument('statistics_dir', help='directory with one sub-directory per fish')
+    parser.add_argument('--method-prefix', default='statistics', help='prefix of the statistics file names')
+    parser.add_argument('--io-workers', type=int, default=1, help='threads used to discover and read statistics files')
 
-            if files:
-                dataFrames[fishName] = pd.read_csv(os.path.join(dataPath, files[0]), sep='\t')
+def addRunArguments(parser, defaultStats):
+    addInputArguments(parser)
+    parser.add_argument('--stats', type=parseList, default=defaultStats, help='comma-separated metrics (default: %s)' % ','.join(defaultStats))
+    parser.add_argument('--cache-dir', default=None, help='cache parsed statistics files in this directory')
+    parser.add_argument('--store', default=None, help='read fish from this ingested store instead of the statistics files')
+    parser.add_argument('--grid-step', type=float, default=None, help='resample slices onto a percentage grid with this step')
+    parser.add_argument('--trace', default=None, help='write stage timings to this file')
+    parser.add_argument('--trace-format', choices=['json', 'chrome'], default='json')
+    parser.add_argument('--dry-run', action='store_true', help='list the discovered files and exit')
 
-            if not cols:
-                cols = dataFrames[fishName].columns.tolist()
+def buildParser():
+    parser = argparse.ArgumentParser(description='Fish phenotype report tools.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
 
-    return dataFrames, cols
+    report = commands.add_parser('report', help='build the PDF report')
+    addRunArguments(report, ['Area', 'Circularity'])
+    report.add_argument('-o', '--output', default='fish-report.pdf')
+    report.add_argument('--title', default="Medaka's report")
+    report.add_argument('--workers', type=int, default=1, help='processes used to render plots (0 for all cores)')
+    report.add_argument('--plot-store', default=None, help='reuse rendered plots stored in this directory')
+    report.add_argument('--plot-mode', choices=['lines', 'bands'], default='lines')
+    report.add_argument('--significance', action='store_true', help='mark slices that differ between classes')
+    report.add_argument('--streaming', action='store_true', help='build the cohort while reading files')
+    report.add_argument('--format', choices=['png', 'vector'], default='png')
+    report.add_argument('--trace-appendix', action='store_true', help='append the stage timings to the PDF')
+    report.add_argument('--compare', type=parseTests, default=[], help='comma-separated class comparison tests: welch, mannwhitney, permutation')
+    report.add_argument('--alpha', type=float, default=0.05, help='false discovery rate for significant slices')
+    report.add_argument('--permutations', type=int, default=10000)
+    report.add_argument('--compare-workers', type=int, default=1, help='processes used for permutation tests (0 for all cores)')
+    report.add_argument('--compare-dir', default=None, help='write comparison tables to this directory')
+    report.add_argument('--fish-pages', action='store_true', help='append a detail page for every fish')
+    report.add_argument('--shard-by', choices=['class', 'fish'], default=None,
+                        help='build the fish pages in parallel, one PDF part per class or per fish, and merge them (needs pypdf or PyPDF2)')
+    report.add_argument('--shard-workers', type=int, default=0, help='processes used to build PDF parts (0 for all cores)')
+    report.add_argument('--qc', action='store_true', help='check every fish for broken or outlying slices and add a QC page')
+    report.add_argument('--qc-threshold', type=float, default=3.5, help='robust z-score above which a slice or slice count is an outlier')
+    report.add_argument('--qc-slice-fraction', type=float, default=0.1, help='fraction of bad slices above which a fish is flagged')
+    report.add_argument('--qc-exclude', action='store_true', help='leave flagged fish out of the plots and statistics')
+    report.add_argument('--qc-file', default=None, help='write the QC results as JSON to this file')
+    report.add_argument('--voxel-size', type=parseVoxelSize, default=None, help='voxel size as x,y,z (default: the store\'s, else 1,1,1)')
+    report.set_defaults(run=runReport)
 
+    spreadsheet = commands.add_parser('spreadsheet', help='write one spreadsheet per metric')
+    addRunArguments(spreadsheet, ['Area', 'Circularity', 'Volume', 'Surface', 'Width', 'Height', 'Length'])
+    spreadsheet.add_argument('-o', '--output', default='Spreadsheets')
+    spreadsheet.add_argument('--format', choices=['csv', 'parquet', 'feather', 'xlsx'], default='csv')
+    spreadsheet.set_defaults(run=runSpreadsheet)
 
-doc = SimpleDocTemplate("test4.pdf")
-style = styles["Normal"]
-styleH1 = styles["Heading1"]
-styleH2 = styles["Heading2"]
+    generate = commands.add_parser('generate', help='write a synthetic cohort')
+    generate.add_argument('output_dir')
+    generate.add_argument('--fish', type=parseFishNumbers, default=[], help='fish numbers, e.g. 200-220,230')
+    generate.add_argument('--seed', type=int, default=None)
+    generate.add_argument('--min-slices', type=int, default=50)
+    generate.add_argument('--max-slices', type=int, default=50)
+    generate.add_argument('--processes', type=int, default=1, help='processes used to generate fish (0 for all cores)')
+    generate.add_argument('--csv', action='store_true', help='write tab-separated csv files instead of statistics files')
+    generate.set_defaults(run=runGenerate)
 
-Story = [Spacer(1,2*inch)]
+    batch = commands.add_parser('batch', help='build every report listed in a manifest, reading each fish once')
+    batch.add_argument('manifest', help='JSON list of report specs with classes, docName and optional mandatoryStats')
+    batch.add_argument('statistics_dir', help='directory with one sub-directory per fish')
+    batch.add_argument('--method-prefix', default='statistics', help='prefix of the statistics file names')
+    batch.add_argument('--io-workers', type=int, default=1, help='threads used to discover and read statistics files')
+    batch.add_argument('--cache-dir', default=None, help='cache parsed statistics files in this directory')
+    batch.add_argument('--store', default=None, help='read fish from this ingested store instead of the statistics files')
+    batch.add_argument('--workers', type=int, default=0, help='processes used to build reports (0 for all cores)')
+    batch.add_argument('--streaming', action='store_true', help='build the cohort while reading files')
+    batch.add_argument('--dry-run', action='store_true', help='list the reports in the manifest and exit')
+    batch.set_defaults(run=runBatch)
 
-data, columns = readDataFrames(pathToStatistics, args)
+    ingest = commands.add_parser('ingest', help='consolidate a statistics tree into a memory-mapped columnar store')
+    ingest.add_argument('statistics_dir', help='directory with one sub-directory per fish')
+    ingest.add_argument('store_dir', help='directory the store is written to (an existing store is replaced; any other existing directory is refused)')
+    ingest.add_argument('--classes', type=parseClasses, default=None, help='class dictionary; every fish directory is ingested without one')
+    ingest.add_argument('--method-prefix', default='statistics', help='prefix of the statistics file names')
+    ingest.add_argument('--io-workers', type=int, default=1, help='threads used to discover and read statistics files')
+    ingest.add_argument('--cache-dir', default=None, help='cache parsed statistics files in this directory')
+    ingest.add_argument('--voxel-size', type=parseVoxelSize, default=[1, 1, 1], help='voxel size as x,y,z (default: 1,1,1)')
+    ingest.set_defaults(run=runIngest)
 
-for column in columns:
-    currentColumn = column.strip()
+    serve = commands.add_parser('serve', help='serve reports and spreadsheets over HTTP with warm caches')
+    serve.add_argument('statistics_dir', help='directory with one sub-directory per fish')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--socket', default=None, help='listen on this Unix socket instead of TCP')
+    serve.add_argument('--workers', type=int, default=2, help='jobs run at the same time')
+    serve.add_argument('--queue-size', type=int, default=16, help='jobs waiting before new ones are refused')
+    serve.add_argument('--method-prefix', default='statistics', help='prefix of the statistics file names')
+    serve.add_argument('--io-workers', type=int, default=1, help='threads used to discover and read statistics files')
+    serve.add_argument('--data-cache-mb', type=int, default=512, help='memory for parsed statistics files')
+    serve.add_argument('--plot-cache-mb', type=int, default=128, help='memory for rendered plots')
+    serve.set_defaults(run=runServe)
 
-    p = Paragraph(currentColumn, styleH1)
-    Story.append(p)
+    validate = commands.add_parser('validate', help='check the class dictionary and statistics files')
+    addInputArguments(validate)
+    validate.add_argument('--stats', type=parseList, default=['Area', 'Circularity'])
+    validate.set_defaults(run=runValidate)
 
-    if currentColumn in metricsInfo:
-        p = Paragraph(metricsInfo[currentColumn], style)
-        Story.append(p)
+    return parser
 
-    newPlot = createPlotWithCol(data, column, args, doc)
-    Story.append(newPlot)
+def main(argv=None):
+    options = buildParser().parse_args(argv)
 
-    Story.append(Spacer(1,0.2*inch))
+    return options.run(options)
 
-doc.build(Story, onFirstPage=titlePage, onLaterPages=regularPage)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def cpuTime():
+    times = os.times()
+
+    return times[0] + times[1]
+
+def peakRss():
+    if resource is None:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+class PipelineTrace:
+    def __init__(self):
+        self.origin = time.time()
+        self.spans = []
+        self.counters = {}
+        self.order = []
+
+    def addSpan(self, name, start, wall, cpu, pid=None, tid=None, **args):
+        if name not in self.order:
+            self.order.append(name)
+
+        self.spans.append({
+            'name': name,
+            'start': start,
+            'wall': wall,
+            'cpu': cpu,
+            'peakRss': args.pop('peakRss', None),
+            'pid': os.getpid() if pid is None else pid,
+            'tid': threading.current_thread().ident if tid is None else tid,
+            'args': args
+        })
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        start, startCpu = time.time(), cpuTime()
+
+        try:
+            yield
+        finally:
+            self.addSpan(name, start, time.time() - start, cpuTime() - startCpu, peakRss=peakRss(), **args)
+
+    def merge(self, spans):
+        for span in spans:
+            self.addSpan(span['name'], span['start'], span['wall'], span['cpu'], span['pid'], span['tid'],
+                         peakRss=span['peakRss'], **span['args'])
+
+    def count(self, name, **counts):
+        if name not in self.order:
+            self.order.append(name)
+
+        stageCounts = self.counters.setdefault(name, {})
+
+        for key, value in counts.items():
+            stageCounts[key] = stageCounts.get(key, 0) + value
+
+    def summary(self):
+        stages = []
+
+        for name in self.order:
+            spans = [span for span in self.spans if span['name'] == name]
+            peaks = [span['peakRss'] for span in spans if span['peakRss'] is not None]
+
+            entry = {
+                'name': name,
+                'calls': len(spans),
+                'wall': sum(span['wall'] for span in spans),
+                'cpu': sum(span['cpu'] for span in spans),
+                'peakRss': max(peaks) if peaks else None
+            }
+            entry.update(self.counters.get(name, {}))
+            stages.append(entry)
+
+        return stages
+
+    def writeJson(self, path):
+        with open(path, 'w') as fp:
+            json.dump({'stages': self.summary(), 'spans': self.spans}, fp, indent=2, sort_keys=True)
+
+    def writeChromeTrace(self, path):
+        events = []
+
+        for span in self.spans:
+            args = dict(span['args'], cpu=span['cpu'])
+
+            if span['peakRss'] is not None:
+                args['peakRss'] = span['peakRss']
+
+            events.append({
+                'name': span['name'],
+                'ph': 'X',
+                'ts': int((span['start'] - self.origin) * 1e6),
+                'dur': int(span['wall'] * 1e6),
+                'pid': span['pid'],
+                'tid': span['tid'],
+                'args': args
+            })
+
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+
+    def write(self, path, traceFormat='json'):
+        if traceFormat == 'chrome':
+            self.writeChromeTrace(path)
+        else:
+            self.writeJson(path)
@@ -0,0 +1,76 @@
+import os
+import json
+import hashlib
+import tempfile
+
+class PlotStore:
+    def __init__(self, _storeDir):
+        self.storeDir = _storeDir
+        self.digestsPath = os.path.join(self.storeDir, 'digests.json')
+        self.digests = {}
+
+        if not os.path.exists(self.storeDir):
+            os.makedirs(self.storeDir)
+
+        if os.path.exists(self.digestsPath):
+            try:
+                with open(self.digestsPath) as fp:
+                    self.digests = json.load(fp)
+            except ValueError:
+                self.digests = {}
+
+    def fileDigest(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [repr(st.st_mtime), st.st_size]
+
+        entry = self.digests.get(path)
+
+        if entry and entry[0] == stamp:
+            return entry[1]
+
+        sha = hashlib.sha1()
+
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                sha.update(chunk)
+
+        self.digests[path] = [stamp, sha.hexdigest()]
+
+        return sha.hexdigest()
+
+    def fingerprint(self, *parts):
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.storeDir, key[:2], key)
+
+    def get(self, key):
+        path = self.getPath(key)
+
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as fp:
+            return fp.read()
+
+    def put(self, key, data):
+        path = self.getPath(key)
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+
+        os.rename(tmpPath, path)
+
+    def save(self):
+        fd, tmpPath = tempfile.mkstemp(dir=self.storeDir, suffix='.tmp')
+
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(self.digests, fp)
+
+        os.rename(tmpPath, self.digestsPath)
@@ -0,0 +1,124 @@
+import ast
+import json
+import multiprocessing
+
+from report_gen import FishReport
+from fish_cohort import makeGrid
+
+batchState = None
+
+def readManifest(path):
+    with open(path) as fp:
+        manifest = json.load(fp)
+
+    specs = manifest['reports'] if isinstance(manifest, dict) else manifest
+
+    for spec in specs:
+        if 'classes' not in spec or 'docName' not in spec:
+            raise ValueError("Report spec needs 'classes' and 'docName': %s" % json.dumps(spec))
+
+        if not isinstance(spec['classes'], dict):
+            spec['classes'] = ast.literal_eval(spec['classes'])
+
+    return specs
+
+def createReport(spec, statisticsDir, **options):
+    options.update(('_' + str(key), value) for key, value in spec.items() if key != 'classes')
+
+    return FishReport(repr(spec['classes']), statisticsDir, **options)
+
+def initBatch(state):
+    global batchState
+    batchState = state
+
+def buildReport(index):
+    specs, statisticsDir, cohorts = batchState
+    report = createReport(specs[index], statisticsDir, _numWorkers=1, _shardWorkers=1)
+    report.generate(cohorts[index])
+
+    return report.docName
+
+class ReportBatch:
+    def __init__(self, _specs, _statisticsDir, _numWorkers=None, _methodPrefix='statistics', _cacheDir=None,
+                 _ioWorkers=1, _streaming=False, _storeDir=None):
+        self.specs = _specs
+        self.statisticsDir = _statisticsDir
+        self.numWorkers = _numWorkers if _numWorkers else multiprocessing.cpu_count()
+        self.methodPrefix = _methodPrefix
+        self.cacheDir = _cacheDir
+        self.ioWorkers = _ioWorkers
+        self.streaming = _streaming
+        self.storeDir = _storeDir
+        self.reports = [createReport(spec, self.statisticsDir) for spec in self.specs]
+
+    def getFishNames(self):
+        fishNames = []
+
+        for report in self.reports:
+            for fishClass, names in report.args.items():
+                for fishName in names:
+                    if fishName not in fishNames:
+                        fishNames.append(fishName)
+
+        return fishNames
+
+    def getMetrics(self):
+        metrics = []
+
+        for report in self.reports:
+            for metric in report.mandatoryStats:
+                if metric not in metrics:
+                    metrics.append(metric)
+
+        return metrics
+
+    def readCohort(self):
+        union = FishReport(repr({'batch': self.getFishNames()}), self.statisticsDir, self.methodPrefix,
+                           _mandatoryStats=self.getMetrics(), _cacheDir=self.cacheDir, _streaming=self.streaming,
+                           _ioWorkers=self.ioWorkers, _storeDir=self.storeDir)
+
+        return union.readCohort(self.statisticsDir)
+
+    def getReportCohorts(self, cohort):
+        metrics = self.getMetrics()
+        gridded = {None: cohort}
+        index = dict((fishName, i) for i, fishName in enumerate(cohort.labels))
+        cohorts = []
+
+        for name in cohort.getMetricNames(metrics):
+            cohort.getMetric(name)
+
+        for report in self.reports:
+            if report.gridStep not in gridded:
+                gridded[report.gridStep] = cohort.resample(makeGrid(report.gridStep), metrics)
+
+            indices, classNames = [], []
+
+            for fishClass, fishNames in report.args.items():
+                for fishName in fishNames:
+                    if fishName in index:
+                        indices.append(index[fishName])
+                        classNames.append(fishClass)
+
+            cohorts.append(gridded[report.gridStep].select(indices, classNames))
+
+        return cohorts
+
+    def generate(self):
+        state = (self.specs, self.statisticsDir, self.getReportCohorts(self.readCohort()))
+
+        if self.numWorkers == 1 or len(self.specs) < 2:
+            initBatch(state)
+
+            try:
+                return [buildReport(index) for index in range(len(self.specs))]
+            finally:
+                initBatch(None)
+
+        pool = multiprocessing.Pool(min(self.numWorkers, len(self.specs)), initBatch, (state,))
+
+        try:
+            return pool.map(buildReport, range(len(self.specs)))
+        finally:
+            pool.close()
+            pool.join()
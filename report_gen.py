@@ -1,27 +1,183 @@
 import os
 import sys
 import ast
-import matplotlib.pyplot as plt
 import numpy as np
-import itertools
+import threading
+import multiprocessing
 from io import BytesIO
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch, cm
-from reportlab.lib.utils import ImageReader
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak
+from reportlab.lib import colors as pdfColors
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.rl_config import defaultPageSize
-import matplotlib.pyplot as plt
+import pandas as pd
+from pandas import DataFrame
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.cm as cmx
-import matplotlib.colors as colors
 import matplotlib.ticker as mtick
 
-import pandas as pd
-from pandas import DataFrame
+from data_cache import FishDataCache, readStatistics, readHeader, csvNewline
+from plot_store import PlotStore
+from fish_cohort import FishCohort, CohortBuilder, makeGrid
+from fish_metrics import getRequiredColumns
+from fish_discovery import FishIndex, findStatisticsFile, prefetch
+from pipeline_trace import PipelineTrace
+
+plotStyle = {
+    'figsize': (10, 5),
+    'position': [0.1, 0.35, .85, .6],
+    'legendColumns': 6,
+    'legendSize': 12,
+    'format': 'png',
+    'dpi': 100
+}
+
+class PlotRenderer:
+    def __init__(self, _style=plotStyle):
+        self.style = _style
+        self.fig = Figure(figsize=self.style['figsize'])
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111)
+        self.ax.set_position(self.style['position'])
+        self.ax.xaxis.set_major_formatter(mtick.FormatStrFormatter('%.0f%%'))
+        self.ax.grid(True)
+        self.ax.set_xlabel('Number of slice (%)', labelpad=5)
+        self.lines = []
+        self.transient = []
+        self.colors = {}
+        self.legend = None
+        self.legendKey = None
+
+    def getColors(self, names, endpoint=True):
+        key = (tuple(names), endpoint)
+
+        if key not in self.colors:
+            self.colors[key] = cmx.hsv(np.linspace(0, 1, len(names), endpoint=endpoint))
+
+        return self.colors[key]
+
+    def setLines(self, count):
+        while len(self.lines) < count:
+            self.lines.append(self.ax.plot([], [])[0])
+
+        while len(self.lines) > count:
+            self.lines.pop().remove()
+
+    def clearTransient(self):
+        for artist in self.transient:
+            artist.remove()
+
+        self.transient = []
+
+    def setLine(self, line, x, y, label, color, linestyle='-'):
+        line.set_data(x, y)
+        line.set_label(label)
+        line.set_color(color)
+        line.set_linestyle(linestyle)
+
+    def render(self, plotData):
+        self.draw(plotData)
+
+        return self.encode()
+
+    def draw(self, plotData):
+        grid = plotData['grid']
+        ax = self.ax
+
+        self.clearTransient()
+
+        if plotData['series'] or plotData['bands']:
+            ax.set_visible(True)
+            ax.set_ylabel(plotData['yLabel'])
+
+            if plotData['bands']:
+                names = [className for className, band in plotData['bands']]
+                self.setLines(2 * len(names))
+
+                for k, ((className, band), color) in enumerate(zip(plotData['bands'], self.getColors(names, False))):
+                    self.transient.append(ax.fill_between(grid, band['low'], band['high'], color=color, alpha=0.25, linewidth=0))
+                    self.setLine(self.lines[2 * k], grid, band['mean'], '%s (mean)' % className, color)
+                    self.setLine(self.lines[2 * k + 1], grid, band['median'], '%s (median)' % className, color, '--')
+
+                for k, ((classA, classB), significant) in enumerate(plotData['markers']):
+                    self.transient.extend(ax.plot(grid[significant], np.full(significant.sum(), 0.98 - 0.03 * k), linestyle='None', marker='*',
+                                                  color='k', transform=ax.get_xaxis_transform(), label="p < %g: %s / %s" % (plotData['alpha'], classA, classB)))
+            else:
+                names = [fishName for fishName, x_perc, values in plotData['series']]
+                self.setLines(len(names))
+
+                for line, (fishName, x_perc, values), color in zip(self.lines, plotData['series'], self.getColors(names)):
+                    self.setLine(line, x_perc, values, fishName, color)
+
+            ax.relim()
+
+            for band in [band for className, band in plotData['bands']]:
+                for edge in (band['low'], band['high']):
+                    finite = np.isfinite(edge)
+                    ax.update_datalim(np.column_stack([grid[finite], edge[finite]]))
+
+            ax.autoscale_view()
+
+            handles = self.lines + [artist for artist in self.transient if artist.get_label() and not artist.get_label().startswith('_')]
+            legendKey = tuple(handle.get_label() for handle in handles)
+
+            if legendKey != self.legendKey:
+                if self.legend is not None:
+                    self.legend.remove()
+
+                legendColumns = min(self.style['legendColumns'], 3) if plotData['bands'] else self.style['legendColumns']
+                self.legend = ax.legend(handles=handles, loc='center', bbox_to_anchor=(0.5, -0.35), ncol=legendColumns, prop={'size': self.style['legendSize']})
+                self.legendKey = legendKey
+        else:
+            ax.set_visible(False)
+
+    def encode(self):
+        imgdata = BytesIO()
+        self.fig.savefig(imgdata, format=self.style['format'], dpi=self.style['dpi'])
+
+        return imgdata.getvalue()
+
+    def close(self):
+        self.fig = None
+
+renderers = threading.local()
+
+def getRenderer():
+    if getattr(renderers, 'renderer', None) is None:
+        renderers.renderer = PlotRenderer()
+
+    return renderers.renderer
+
+def closeRenderer():
+    if getattr(renderers, 'renderer', None) is not None:
+        renderers.renderer.close()
+        renderers.renderer = None
+
+def renderPlot(plotData):
+    return getRenderer().render(plotData)
+
+def renderPlotTimed(plotData):
+    plotRenderer = getRenderer()
+    trace = PipelineTrace()
+
+    with trace.stage('rendering', column=plotData['column']):
+        plotRenderer.draw(plotData)
+
+    with trace.stage('png-encoding', column=plotData['column']):
+        pngData = plotRenderer.encode()
+
+    return pngData, trace.spans
 
 class FishReport:
     def __init__(self, _args, _statisticsDir, _methodPrefix='statistics',
-            _mainTitle="Medaka's report", _docName="fish-report.pdf", _mandatoryStats=['Area','']):
+            _mainTitle="Medaka's report", _docName="fish-report.pdf", _mandatoryStats=['Area',''], _numWorkers=1,
+            _cacheDir=None, _plotStoreDir=None, _gridStep=None, _plotMode='lines', _bandPercentiles=(25, 75),
+            _significance=False, _streaming=False, _ioWorkers=1, _plotFormat='png', _decimate=None,
+            _traceFile=None, _traceFormat='json', _traceAppendix=False, _comparison=(), _alpha=0.05, _permutations=10000,
+            _comparisonSeed=0, _comparisonWorkers=1, _comparisonDir=None, _storeDir=None, _fishPages=None, _shardBy=None,
+            _shardWorkers=1, _qc=False, _qcThreshold=3.5, _qcSliceFraction=0.1, _qcExclude=False, _qcFile=None, _voxelSize=None):
+        self.options = dict((key, value) for key, value in locals().items() if key != 'self')
         self.statisticsDir = _statisticsDir
         self.methodPrefix = _methodPrefix
         self.pageWidth = defaultPageSize[0]
@@ -29,7 +185,7 @@ class FishReport:
         self.styles = getSampleStyleSheet()
         self.args = ast.literal_eval(_args)
         self.mainTitle = _mainTitle
-        self.voxelSize = [1, 1, 1]
+        self.voxelSize = _voxelSize
         self.subTitleText = "Comparison of phenotypes form %s classes" % (', '.join(["'%s'" % k for k in self.args.keys()]))
         self.metricsInfo = {
             'CSIndex': 'Index if the current cross-section.',
@@ -87,6 +243,54 @@ class FishReport:
         }
         self.mandatoryStats = _mandatoryStats
         self.docName = _docName
+        self.numWorkers = _numWorkers if _numWorkers else multiprocessing.cpu_count()
+        self.cache = FishDataCache(_cacheDir) if _cacheDir else None
+        self.index = FishIndex(_statisticsDir, _methodPrefix, _cacheDir)
+        self.plotStore = PlotStore(_plotStoreDir) if _plotStoreDir else None
+        self.store = None
+
+        if _storeDir:
+            from fish_store import FishStore
+
+            self.store = FishStore(_storeDir)
+
+        self.plotMode = _plotMode
+        self.bandPercentiles = _bandPercentiles
+        self.significance = _significance
+        self.gridStep = _gridStep if _gridStep or self.plotMode != 'bands' else 1
+        self.streaming = _streaming
+        self.ioWorkers = _ioWorkers
+        self.plotFormat = _plotFormat
+        self.decimate = _decimate if _decimate is not None else self.plotFormat == 'vector'
+        self.trace = PipelineTrace()
+        self.traceFile = _traceFile
+        self.traceFormat = _traceFormat
+        self.traceAppendix = _traceAppendix
+        self.comparison = _comparison
+
+        if self.comparison:
+            from class_stats import comparisonTests
+
+            unknown = [test for test in self.comparison if test not in comparisonTests]
+
+            if unknown:
+                raise ValueError('Unknown comparison tests: %s (expected %s)' % (', '.join(unknown), ', '.join(sorted(comparisonTests))))
+
+        self.alpha = _alpha
+        self.permutations = _permutations
+        self.comparisonSeed = _comparisonSeed
+        self.comparisonWorkers = _comparisonWorkers if _comparisonWorkers else multiprocessing.cpu_count()
+        self.comparisonDir = _comparisonDir
+        self.comparisons = {}
+        self.shardBy = _shardBy
+        self.shardWorkers = _shardWorkers if _shardWorkers else multiprocessing.cpu_count()
+        self.fishPages = _fishPages if _fishPages is not None else self.shardBy is not None
+        self.qc = _qc or _qcExclude or bool(_qcFile)
+        self.qcThreshold = _qcThreshold
+        self.qcSliceFraction = _qcSliceFraction
+        self.qcExclude = _qcExclude
+        self.qcFile = _qcFile
+        self.qcReport = None
         self.doc = SimpleDocTemplate(self.docName)
         self.style = self.styles["Normal"]
         self.styleH1 = self.styles["Heading1"]
@@ -107,106 +311,517 @@ class FishReport:
         canvas.drawString(inch, 0.75 * inch, "%d" % (doc.page))
         canvas.restoreState()
 
-    def getDataByColumn(self, fishName, column, dataFrames):
-        dataFrame = None
-
-        if column == 'Area':
-            dataFrame = dataFrames[fishName]['Area']
-        elif column == 'Circularity':
-            dataFrame = 2.0*np.sqrt(dataFrames[fishName]['Area']) / dataFrames[fishName]['Perim.']
-        elif column == 'Surface':
-            dataFrame = dataFrames[fishName]['Perim.'].sum() / (self.voxelSize[0] * self.voxelSize[1])
-        elif column == 'Volume':
-            dataFrame = dataFrames[fishName]['Area'].sum() / (self.voxelSize[0] * self.voxelSize[1])
-        elif column == 'Length':
-            dataFrame = dataFrames[fishName]['Area'].count()
-        elif column == 'Width':
-            dataFrame = dataFrames[fishName]['Width'].max()
-        elif column == 'Height':
-            dataFrame = dataFrames[fishName]['Height'].max()
-        else:
-            print 'Incorrent column!'
+    def getPlotData(self, data, column, args):
+        plotData = {'column': column, 'yLabel': self.unitsInfo.get(column, ''), 'grid': data.grid,
+                    'series': [], 'bands': [], 'markers': []}
 
-        return dataFrame
+        values = data.getDataByColumn(column, self.voxelSize)
 
+        if values is not None and values.ndim == 2:
+            if self.plotMode == 'bands':
+                from class_stats import classBands, significantSlices
 
-    def createPlotWithCol(self, dataFrames, column, args, doc):
-        fig = plt.figure(figsize=(10, 5))
-        ax = fig.add_subplot(111)
-        ax.set_position([0.1, 0.35, .85, .6])
+                bands = classBands(values, data.classIndex, len(data.classes), self.bandPercentiles)
+                plotData['bands'] = list(zip(data.classes, bands))
 
-        fishes_names = [i for i in itertools.chain.from_iterable(args.values())]
-        colors = cmx.hsv(np.linspace(0, 1, len(fishes_names)))
+                if self.significance:
+                    plotData['markers'] = significantSlices(values, data.classIndex, data.classes, self.alpha)
+                    plotData['alpha'] = self.alpha
+            else:
+                from vector_plot import decimateMinMax
 
-        if column == 'Area' or column == 'Circularity':
-            for fishName, color in zip(fishes_names, colors):
-                data_len = len(getDataByColumn(fishName, column, dataFrames))
-                x_perc = np.linspace(0, 100, data_len)
-                ax.plot(x_perc, getDataByColumn(fishName, column, dataFrames), label=fishName, color=color)
+                columns = int(plotStyle['figsize'][0] * plotStyle['dpi'] * plotStyle['position'][2])
 
-            x_axix_format = '%.0f%%'
-            xticks = mtick.FormatStrFormatter(x_axix_format)
-            ax.xaxis.set_major_formatter(xticks)
-            ax.grid(True)
+                for index, fishName in enumerate(data.labels):
+                    fishValues = values[index, :data.lengths[index]]
+                    x_perc = data.grid if data.grid is not None else np.linspace(0, 100, len(fishValues))
 
-            plt.xlabel('Number of slice (%)', labelpad=5)
-            plt.ylabel(self.unitsInfo[column])
-            
-            ax.legend(loc='center', bbox_to_anchor=(0.5, -0.35), ncol=6, prop={'size': 12})
+                    if self.decimate:
+                        x_perc, fishValues = decimateMinMax(x_perc, fishValues, columns)
 
-        imgdata = BytesIO()
-        fig.savefig(imgdata, format='png')
-        imgdata.seek(0)
-        img = Image(imgdata)
+                    plotData['series'].append((fishName, x_perc, fishValues))
+
+        return plotData
+
+    def createImage(self, pngData, doc):
+        img = Image(BytesIO(pngData))
         img._restrictSize(doc.width, doc.height)
 
         return img
 
+    def createPlotWithCol(self, data, column, args, doc):
+        return self.createImage(renderPlot(self.getPlotData(data, column, args)), doc)
+
+    def renderPlots(self, data, columns):
+        plotsData = []
+
+        for column in columns:
+            with self.trace.stage('metrics', column=column):
+                plotsData.append(self.getPlotData(data, column, self.args))
+
+        if self.plotFormat == 'vector':
+            from vector_plot import VectorPlot
+
+            vectorPlot = VectorPlot(self.doc.width, plotStyle)
+            plots = []
+
+            for plotData in plotsData:
+                with self.trace.stage('rendering', column=plotData['column']):
+                    plots.append(vectorPlot.build(plotData))
+
+            return plots
+
+        if self.numWorkers == 1 or len(plotsData) < 2:
+            try:
+                results = [renderPlotTimed(plotData) for plotData in plotsData]
+            finally:
+                closeRenderer()
+        else:
+            pool = multiprocessing.Pool(min(self.numWorkers, len(plotsData)))
+
+            try:
+                results = pool.map(renderPlotTimed, plotsData)
+            finally:
+                pool.close()
+                pool.join()
+
+        for pngData, spans in results:
+            self.trace.merge(spans)
+
+        return [pngData for pngData, spans in results]
+
+    def renderPlotsIncremental(self, inputPath, columns):
+        sources = []
+
+        if self.store is not None:
+            for fishClass, fishNames in self.args.items():
+                for fishName in fishNames:
+                    sources.append((fishClass, fishName, 'store', self.store.storeId if fishName in self.store else None))
+        else:
+            for fishClass, fishName, sourceFile, meta in self.discoverFiles(inputPath):
+                if sourceFile:
+                    sources.append((fishClass, fishName, os.path.basename(sourceFile), self.plotStore.fileDigest(sourceFile)))
+                else:
+                    sources.append((fishClass, fishName, None, None))
+
+        keys = [self.plotStore.fingerprint(column, sources, self.voxelSize, self.gridStep, self.unitsInfo.get(column, ''),
+                                            self.plotMode, self.bandPercentiles, self.significance, self.alpha, self.plotFormat, bool(self.decimate),
+                                            self.qcExclude and [self.qcThreshold, self.qcSliceFraction], plotStyle) for column in columns]
+        plots = [self.plotStore.get(key) for key in keys]
+        missing = [i for i, pngData in enumerate(plots) if pngData is None]
+
+        if missing:
+            data = self.readCohort(inputPath)
+
+            for i, pngData in zip(missing, self.renderPlots(data, [columns[i] for i in missing])):
+                self.plotStore.put(keys[i], pngData)
+                plots[i] = pngData
+
+        self.plotStore.save()
+
+        return plots
+
+    def findStatisticsFile(self, dataPath):
+        return findStatisticsFile(dataPath, self.methodPrefix)
+
+    def discoverFiles(self, inputPath):
+        fishes = [(fishClass, fishName) for fishClass, fishNames in self.args.items() for fishName in fishNames]
+        index = self.index if inputPath == self.statisticsDir else FishIndex(inputPath, self.methodPrefix)
+
+        with self.trace.stage('discovery'):
+            files = index.locate([fishName for fishClass, fishName in fishes], self.ioWorkers)
+
+        self.trace.count('discovery', fish=len(fishes), found=sum(1 for fishName in files if files[fishName]))
+
+        return [(fishClass, fishName) + (files[fishName] or (None, None)) for fishClass, fishName in fishes]
+
+    def parseStatistics(self, source, columns=None, dtype=None):
+        with self.trace.stage('parsing', fish=source[1]):
+            return readStatistics(source[2], ';', self.cache, columns, dtype)
+
+    def parsePresentColumns(self, source, columns):
+        present = [column for column in columns if column in readHeader(source[2], ';')]
+
+        return self.parseStatistics(source, present, dict((column, np.float64) for column in present))
+
+    def countParsed(self, sourceFile, dataFrame):
+        self.trace.count('parsing', fish=1, rows=len(dataFrame), bytesRead=os.path.getsize(sourceFile))
+
     def readDataFrames(self, inputPath, fishClasses):
         dataFrames = {}
+        fishMeta = {}
         cols = []
-        totalVolumeSize = 0.
+
+        sources = [source for source in self.discoverFiles(inputPath) if source[2]]
+        read = lambda source: self.parseStatistics(source)
+
+        for (fishClass, fishName, sourceFile, meta), (dataFrame, nameMeta) in zip(sources, prefetch(sources, read, self.ioWorkers)):
+            self.countParsed(sourceFile, dataFrame)
+
+            dataFrames[fishName] = dataFrame
+            fishMeta[fishName] = meta
+
+            cols.extend(column for column in dataFrame.columns if column not in cols)
+
+        return dataFrames, cols, fishMeta
+
+    def iterStatistics(self, inputPath, columns):
+        dtype = dict((column, np.float64) for column in columns)
+
+        sources = [source for source in self.discoverFiles(inputPath) if source[2]]
+        read = lambda source: self.parsePresentColumns(source, columns) if self.qc else self.parseStatistics(source, columns, dtype)
+
+        for (fishClass, fishName, sourceFile, meta), (dataFrame, nameMeta) in zip(sources, prefetch(sources, read, self.ioWorkers)):
+            self.countParsed(sourceFile, dataFrame)
+
+            yield fishClass, fishName, dataFrame, meta
+
+    def readCohortStreaming(self, inputPath):
+        columns = getRequiredColumns(self.mandatoryStats)
+        builder = CohortBuilder(columns, makeGrid(self.gridStep) if self.gridStep and not self.qc else None, _metrics=self.mandatoryStats)
+
+        for fishClass, fishName, dataFrame, meta in self.iterStatistics(inputPath, columns):
+            with self.trace.stage('normalization', fish=fishName):
+                builder.add(fishName, fishClass, dict((column, dataFrame[column].values if column in dataFrame else np.full(len(dataFrame), np.nan))
+                                                      for column in columns), *meta)
+
+        with self.trace.stage('normalization'):
+            cohort = builder.build()
+
+        return self.finishCohort(cohort)
+
+    def readStoreCohort(self):
+        with self.trace.stage('normalization'):
+            cohort = self.store.readCohort(self.args, getRequiredColumns(self.mandatoryStats))
+
+        self.trace.count('discovery', fish=sum(len(fishNames) for fishNames in self.args.values()), found=len(cohort))
+
+        return self.finishCohort(cohort)
+
+    def finishCohort(self, cohort):
+        if self.qc:
+            cohort = self.checkQuality(cohort)
+
+        if self.gridStep and cohort.grid is None:
+            with self.trace.stage('normalization'):
+                cohort = cohort.resample(makeGrid(self.gridStep), self.mandatoryStats)
+
+        return cohort
+
+    def readCohort(self, inputPath):
+        if self.store is not None:
+            return self.readStoreCohort()
+
+        if self.streaming:
+            return self.readCohortStreaming(inputPath)
+
+        dataFrames, cols, fishMeta = self.readDataFrames(inputPath, self.args)
+        labels, classNames, meta = [], [], []
+        series = dict((column, []) for column in getRequiredColumns(self.mandatoryStats) if column in cols)
 
         for fishClass, fishNames in self.args.items():
             for fishName in fishNames:
-                dataPath = os.path.join(inputPath, fishName)
-                files = [f for f in os.listdir(dataPath) if os.path.isfile(os.path.join(dataPath,f)) and f.startswith(self.methodPrefix)]
+                if fishName in dataFrames:
+                    dataFrame = dataFrames[fishName]
 
-                if files:
-                    name_comps = files[0].split('_')
+                    for column, values in series.items():
+                        values.append(np.asarray(dataFrame[column], dtype=float) if column in dataFrame else np.full(len(dataFrame), np.nan))
 
-                    if float(name_comps[1]):
-                        totalVolumeSize = float(name_comps[1])
-                    
-                    dataFrames[fishName] = pd.read_csv(os.path.join(dataPath, files[0]), sep=';')
+                    labels.append(fishName)
+                    classNames.append(fishClass)
+                    meta.append(fishMeta[fishName])
 
-                    if totalVolumeSize:
-                        dataFrames[fishName] = dataFrames[fishName].div(totalVolumeSize)
+        volume, surface, length = zip(*meta) if meta else ((), (), ())
 
-                if not cols:
-                    cols = dataFrames[fishName].columns.tolist()
+        with self.trace.stage('normalization'):
+            cohort = FishCohort.fromSeries(labels, classNames, series, volume, surface, length)
 
-        return dataFrames, cols
+        return self.finishCohort(cohort)
 
-    def generate(self):
-        data, columns = self.readDataFrames(self.statisticsDir, self.args)
+    def generate(self, data=None):
+        if self.qc and data is None:
+            data = self.readCohort(self.statisticsDir)
+        elif self.qc:
+            data = self.checkQuality(data)
 
-        for column in self.mandatoryStats:
+        if data is None and self.plotStore and self.plotFormat == 'png':
+            plots = self.renderPlotsIncremental(self.statisticsDir, self.mandatoryStats)
+        else:
+            data = self.readCohort(self.statisticsDir) if data is None else data
+            plots = self.renderPlots(data, self.mandatoryStats)
+
+        if self.comparison or self.fishPages:
+            data = self.readCohort(self.statisticsDir) if data is None else data
+
+        if self.comparison:
+            with self.trace.stage('comparison'):
+                self.comparisons = self.compareClasses(data)
+
+            if self.comparisonDir:
+                self.writeComparisons(self.comparisonDir, self.comparisons)
+
+        if self.shardBy:
+            from report_shards import buildShardedDocument
+
+            buildShardedDocument(self, plots, data)
+        else:
+            self.buildDocument(plots, data)
+
+        if self.traceFile:
+            self.trace.write(self.traceFile, self.traceFormat)
+
+    def checkQuality(self, data):
+        from fish_qc import runQualityChecks, excludeFlagged, writeQcReport
+
+        with self.trace.stage('qc'):
+            self.qcReport = runQualityChecks(data, [column.strip() for column in self.mandatoryStats], getRequiredColumns(self.mandatoryStats),
+                                             self.qcThreshold, self.qcSliceFraction, self.voxelSize)
+
+            if self.qcExclude:
+                data = excludeFlagged(data, self.qcReport)
+
+        self.trace.count('qc', fish=self.qcReport['checked'], flagged=self.qcReport['flagged'], excluded=self.qcReport['excluded'])
+
+        if self.qcFile:
+            writeQcReport(self.qcFile, self.qcReport)
+
+        return data
+
+    def createQcStory(self):
+        report = self.qcReport
+        story = [Paragraph('Quality control', self.styleH1),
+                 Paragraph('%d fish checked, %d flagged, %d excluded. Slices are outliers when their robust z-score (median/MAD across the fish of the same class) exceeds %g; '
+                           'a fish is flagged when more than %.0f%% of its slices are outliers or broken, its slice count is an outlier, its stack is shorter than the z-range in its file name or a column is missing.'
+                           % (report['checked'], report['flagged'], report['excluded'], report['threshold'], 100 * report['sliceFraction']), self.style)]
+
+        if report['gridPoints']:
+            story.append(Paragraph('The cohort was already resampled to %d points per fish, so zero-area, NaN-perimeter and outlier counts refer to grid points rather than slices.'
+                                   % report['gridPoints'], self.style))
+
+        if report['missingColumns']:
+            story.append(Paragraph('Missing columns: %s' % ', '.join(report['missingColumns']), self.style))
+
+        rows = [['Fish', 'Class', 'Slices', 'Zero area', 'NaN perim.', 'Outliers', 'Reasons']]
+
+        for fish in report['fish']:
+            if fish['flagged']:
+                rows.append([fish['label'], fish['class'], fish['slices'], len(fish['zeroAreaSlices']), len(fish['nanPerimeterSlices']),
+                             '%.0f%%' % (100 * fish['outlierFraction']),
+                             Paragraph(('excluded: ' if fish['excluded'] else '') + '; '.join(fish['reasons']), self.styles['BodyText'])])
+
+        if len(rows) > 1:
+            table = Table(rows, colWidths=[None] * 6 + [2.4 * inch], hAlign='LEFT', repeatRows=1)
+            table.setStyle(TableStyle([
+                ('FONTSIZE', (0, 0), (-1, -1), 8),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('ALIGN', (2, 0), (5, -1), 'RIGHT'),
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('LINEBELOW', (0, 0), (-1, 0), 0.5, pdfColors.black)
+            ]))
+            story.append(table)
+
+        return story
+
+    def createMetricStory(self, plots):
+        story = []
+
+        for column, plot in zip(self.mandatoryStats, plots):
             currentColumn = column.strip()
 
             p = Paragraph(currentColumn, self.styleH1)
-            self.story.append(p)
+            story.append(p)
 
             if currentColumn in self.metricsInfo:
                 p = Paragraph(self.metricsInfo[currentColumn], self.style)
-                self.story.append(p)
+                story.append(p)
+
+            newPlot = self.createImage(plot, self.doc) if isinstance(plot, bytes) else plot
+            story.append(newPlot)
+
+            if column in self.comparisons:
+                story.append(Paragraph('Class comparison', self.styleH2))
+                story.append(self.createComparisonTable(*self.comparisons[column]))
+
+            story.append(Spacer(1, 0.1 * inch))
+
+        return story
+
+    def getFishParts(self, data):
+        parts = []
+
+        for classIdx, className in enumerate(data.classes):
+            fishes = [(index, k == 0) for k, index in enumerate(np.flatnonzero(data.classIndex == classIdx))]
+
+            if self.shardBy == 'fish':
+                parts.extend([fish] for fish in fishes)
+            else:
+                parts.append(fishes)
+
+        return parts
+
+    def createFishPlot(self, data, column, index):
+        values = data.getFishSeries(column, index, self.voxelSize)
+        x_perc = data.grid if data.grid is not None else np.linspace(0, 100, len(values))
+        plotData = {'column': column, 'yLabel': self.unitsInfo.get(column, ''), 'grid': data.grid,
+                    'series': [(data.labels[index], x_perc, values)], 'bands': [], 'markers': []}
+
+        if self.plotFormat == 'vector':
+            from vector_plot import VectorPlot
+
+            return VectorPlot(self.doc.width, plotStyle).build(plotData)
+
+        return self.createImage(renderPlot(plotData), self.doc)
+
+    def createFishTable(self, data, index):
+        rows = [['Class', data.classes[data.classIndex[index]]], ['Slices', '%d' % data.sliceCounts[index]]]
+
+        for name in ['Volume', 'Surface', 'Length'] + [column.strip() for column in self.mandatoryStats]:
+            values = data.getDataByColumn(name, self.voxelSize)
+
+            if values is not None and values.ndim == 1 and name not in [row[0] for row in rows]:
+                rows.append([name, '%.4g' % values[index]])
+
+        table = Table(rows, hAlign='LEFT')
+        table.setStyle(TableStyle([
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('ALIGN', (1, 0), (-1, -1), 'RIGHT')
+        ]))
+
+        return table
+
+    def createFishStory(self, data, part):
+        story = []
+
+        for index, classHeading in part:
+            if story:
+                story.append(PageBreak())
+
+            if classHeading:
+                story.append(Paragraph(data.classes[data.classIndex[index]], self.styleH1))
+
+            story.append(Paragraph(data.labels[index], self.styleH2))
+            story.append(self.createFishTable(data, index))
+
+            for column in self.mandatoryStats:
+                values = data.getDataByColumn(column.strip(), self.voxelSize)
+
+                if values is not None and values.ndim == 2:
+                    story.append(Paragraph(column.strip(), self.styles['Heading3']))
+                    story.append(self.createFishPlot(data, column.strip(), index))
+
+        return story
+
+    def createTraceStory(self):
+        return [Paragraph('Pipeline profile', self.styleH1), self.createTraceTable(self.trace.summary())]
+
+    def buildDocument(self, plots, data=None):
+        if self.qcReport is not None:
+            self.story.extend(self.createQcStory())
+            self.story.append(PageBreak())
+
+        self.story.extend(self.createMetricStory(plots))
+
+        if self.fishPages:
+            with self.trace.stage('fish-pages'):
+                for part in self.getFishParts(data):
+                    self.story.append(PageBreak())
+                    self.story.extend(self.createFishStory(data, part))
+
+        if self.traceAppendix:
+            self.story.append(PageBreak())
+            self.story.extend(self.createTraceStory())
+
+        with self.trace.stage('build'):
+            self.doc.build(self.story, onFirstPage=self.titlePage, onLaterPages=self.regularPage)
+
+    def compareClasses(self, data):
+        from class_stats import compareClasses
+
+        if data.grid is None:
+            data = data.resample(makeGrid(self.gridStep or 1), self.mandatoryStats)
+
+        comparisons = {}
+
+        for column in self.mandatoryStats:
+            values = data.getDataByColumn(column, self.voxelSize)
+
+            if values is not None and values.ndim == 2 and len(data.classes) > 1:
+                comparisons[column] = (data.grid, compareClasses(values, data.classIndex, data.classes, self.comparison, self.alpha,
+                                                                 self.permutations, self.comparisonSeed, self.comparisonWorkers))
+
+        return comparisons
+
+    def createComparisonTable(self, grid, comparisons):
+        from class_stats import significantRanges
+
+        rows = [['Classes', 'Test', 'Significant slices (q < %g)' % self.alpha, 'Min q']]
+
+        for comparison in comparisons:
+            for test in self.comparison:
+                result = comparison[test]
+                ranges = significantRanges(result['significant'], grid)
+                minQ = np.nanmin(result['q']) if np.isfinite(result['q']).any() else np.nan
+
+                rows.append(['%s / %s' % comparison['classes'], test,
+                             Paragraph(', '.join(('%g-%g%%' % r) if r[0] != r[1] else ('%g%%' % r[0]) for r in ranges) or '-', self.style), '%.3g' % minQ])
+
+        table = Table(rows, colWidths=[0.25 * self.doc.width, 0.15 * self.doc.width, 0.45 * self.doc.width, 0.15 * self.doc.width], hAlign='LEFT')
+        table.setStyle(TableStyle([
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('LINEBELOW', (0, 0), (-1, 0), 0.5, pdfColors.black)
+        ]))
+
+        return table
+
+    def writeComparisons(self, outputDir, comparisons):
+        from class_stats import significantRanges
+
+        if not os.path.exists(outputDir):
+            os.makedirs(outputDir)
+
+        ranges = []
+
+        for column in [column for column in self.mandatoryStats if column in comparisons]:
+            grid, columnComparisons = comparisons[column]
+            table = DataFrame(index=pd.Index(grid, name='Slice (%)'))
+
+            for comparison in columnComparisons:
+                pair = '%s vs %s' % comparison['classes']
+
+                for test in self.comparison:
+                    result = comparison[test]
+                    table['%s %s statistic' % (pair, test)] = result['statistic']
+                    table['%s %s p' % (pair, test)] = result['p']
+                    table['%s %s q' % (pair, test)] = result['q']
+
+                    for start, end in significantRanges(result['significant'], grid):
+                        ranges.append((column, comparison['classes'][0], comparison['classes'][1], test, start, end))
+
+            table.to_csv(os.path.join(outputDir, 'comparison_%s.csv' % column), sep=';', na_rep='', **csvNewline)
+
+        DataFrame(ranges, columns=['Metric', 'Class A', 'Class B', 'Test', 'Start (%)', 'End (%)']).to_csv(
+            os.path.join(outputDir, 'significant_slices.csv'), sep=';', index=False, **csvNewline)
+
+    def createTraceTable(self, stages):
+        megabyte = lambda value: '%.1f' % (value / 1048576.) if value is not None else '-'
+        rows = [['Stage', 'Calls', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)', 'Fish', 'Rows', 'Read (MB)']]
 
-            newPlot = self.createPlotWithCol(data, column, self.args, self.doc)
-            self.story.append(newPlot)
+        for stage in stages:
+            rows.append([stage['name'], stage['calls'], '%.3f' % stage['wall'], '%.3f' % stage['cpu'], megabyte(stage['peakRss']),
+                         stage.get('fish', '-'), stage.get('rows', '-'), megabyte(stage.get('bytesRead'))])
 
-            self.story.append(Spacer(1, 0.1 * inch))
+        table = Table(rows, hAlign='LEFT')
+        table.setStyle(TableStyle([
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+            ('LINEBELOW', (0, 0), (-1, 0), 0.5, pdfColors.black)
+        ]))
 
-        self.doc.build(self.story, onFirstPage=self.titlePage, onLaterPages=self.regularPage)
+        return table
 
 def main(args):
     fishReport = FishReport(args, '/Users/rshkarin/Documents/fish-report-generator/Results')
@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import zipfile
+import tempfile
+import threading
+import collections
+from io import BytesIO
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from Queue import Queue, Full
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from queue import Queue, Full
+
+import pandas as pd
+
+from plot_store import PlotStore
+from fish_discovery import FishIndex, parseStatisticsName
+from report_batch import createReport
+from data_concatenator import FishDataConcatenator
+
+reportOptions = ('mandatoryStats', 'mainTitle', 'gridStep', 'plotMode', 'bandPercentiles', 'significance',
+                 'plotFormat', 'decimate', 'traceAppendix', 'comparison', 'alpha', 'permutations', 'comparisonSeed',
+                 'fishPages', 'qc', 'qcThreshold', 'qcSliceFraction', 'qcExclude')
+spreadsheetOptions = ('mandatoryStats', 'outputFormat', 'gridStep')
+
+class LRUCache:
+    def __init__(self, _maxSize, _sizeOf=len):
+        self.maxSize = _maxSize
+        self.sizeOf = _sizeOf
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries[key] = entry
+            self.hits += 1
+
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeOf(value)
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+
+            if entry is not None:
+                self.size -= entry[1]
+
+            if size > self.maxSize:
+                return
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.maxSize:
+                evicted, (value, size) = self.entries.popitem(last=False)
+                self.size -= size
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'size': self.size, 'maxSize': self.maxSize,
+                    'hits': self.hits, 'misses': self.misses}
+
+class MemoryDataCache:
+    def __init__(self, _maxSize=512 * 1024 * 1024):
+        self.entries = LRUCache(_maxSize, lambda entry: int(entry[0].memory_usage(index=True).sum()))
+
+    def readStatistics(self, path, sep=';', usecols=None, dtype=None):
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime, st.st_size, sep)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            entry = (pd.read_csv(path, sep=sep), parseStatisticsName(path))
+            self.entries.put(key, entry)
+
+        dataFrame, meta = entry
+
+        if usecols is not None:
+            dataFrame = dataFrame[list(usecols)]
+
+        return (dataFrame.astype(dtype) if dtype else dataFrame), meta
+
+class MemoryPlotStore(PlotStore):
+    def __init__(self, _maxSize=128 * 1024 * 1024):
+        self.digests = {}
+        self.plots = LRUCache(_maxSize)
+
+    def get(self, key):
+        return self.plots.get(key)
+
+    def put(self, key, data):
+        self.plots.put(key, data)
+
+    def save(self):
+        pass
+
+class ReportJob:
+    def __init__(self, _kind, _spec):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = _kind
+        self.spec = _spec
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.contentType = None
+        self.error = None
+        self.stages = []
+        self.done = threading.Event()
+
+    def getMetrics(self):
+        metrics = {'id': self.id, 'kind': self.kind, 'status': 'queued', 'submitted': self.submitted}
+
+        if self.started is not None:
+            metrics.update(status='running', queueTime=self.started - self.submitted)
+
+        if self.finished is not None:
+            metrics.update(status='failed' if self.error else 'done', runTime=self.finished - self.started,
+                           latency=self.finished - self.submitted, stages=self.stages)
+
+            if self.error:
+                metrics['error'] = self.error
+            else:
+                metrics['bytes'] = len(self.result)
+
+        return metrics
+
+class ReportServer:
+    def __init__(self, _statisticsDir, _numWorkers=2, _queueSize=16, _methodPrefix='statistics', _ioWorkers=1,
+                 _dataCacheSize=512 * 1024 * 1024, _plotCacheSize=128 * 1024 * 1024, _history=100):
+        self.statisticsDir = _statisticsDir
+        self.numWorkers = _numWorkers
+        self.methodPrefix = _methodPrefix
+        self.ioWorkers = _ioWorkers
+        self.dataCache = MemoryDataCache(_dataCacheSize)
+        self.plotStore = MemoryPlotStore(_plotCacheSize)
+        self.index = FishIndex(_statisticsDir, _methodPrefix)
+        self.queue = Queue(_queueSize)
+        self.jobs = collections.OrderedDict()
+        self.history = _history
+        self.lock = threading.Lock()
+        self.workers = []
+        self.httpServer = None
+
+    def start(self):
+        for i in range(self.numWorkers):
+            worker = threading.Thread(target=self.work, name='report-worker-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, kind, spec):
+        allowed = reportOptions if kind == 'report' else spreadsheetOptions
+        unknown = [key for key in spec if key != 'classes' and key not in allowed]
+
+        if 'classes' not in spec or not isinstance(spec['classes'], dict):
+            raise ValueError("Job needs a 'classes' dictionary")
+
+        if unknown:
+            raise ValueError('Unsupported %s options: %s' % (kind, ', '.join(sorted(unknown))))
+
+        job = ReportJob(kind, spec)
+        self.queue.put_nowait(job)
+
+        with self.lock:
+            self.jobs[job.id] = job
+
+            finished = [jobId for jobId, oldJob in self.jobs.items() if oldJob.done.is_set()]
+
+            for jobId in finished[:max(0, len(self.jobs) - self.history)]:
+                del self.jobs[jobId]
+
+        return job
+
+    def getJob(self, jobId):
+        with self.lock:
+            return self.jobs.get(jobId)
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            job.started = time.time()
+
+            try:
+                if job.kind == 'report':
+                    job.result, job.contentType = self.runReport(job)
+                else:
+                    job.result, job.contentType = self.runSpreadsheet(job)
+            except Exception as e:
+                job.error = '%s: %s' % (type(e).__name__, e)
+            finally:
+                job.finished = time.time()
+                job.done.set()
+                self.queue.task_done()
+
+    def runReport(self, job):
+        output = BytesIO()
+        spec = dict(job.spec, docName=output)
+        report = createReport(spec, self.statisticsDir, _methodPrefix=self.methodPrefix, _ioWorkers=self.ioWorkers)
+        report.cache = self.dataCache
+        report.index = self.index
+        report.plotStore = self.plotStore
+        report.generate()
+        job.stages = report.trace.summary()
+
+        return output.getvalue(), 'application/pdf'
+
+    def runSpreadsheet(self, job):
+        outputPath = tempfile.mkdtemp(prefix='fish-spreadsheets-')
+        options = dict(('_' + str(key), value) for key, value in job.spec.items() if key != 'classes')
+
+        try:
+            concatenator = FishDataConcatenator(repr(job.spec['classes']), self.statisticsDir, outputPath,
+                                                self.methodPrefix, _ioWorkers=self.ioWorkers, **options)
+            concatenator.cache = self.dataCache
+            concatenator.index = self.index
+            concatenator.generateSpreadsheets()
+            job.stages = concatenator.trace.summary()
+
+            archive = BytesIO()
+
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for fileName in sorted(os.listdir(outputPath)):
+                    zf.write(os.path.join(outputPath, fileName), fileName)
+
+            return archive.getvalue(), 'application/zip'
+        finally:
+            shutil.rmtree(outputPath, ignore_errors=True)
+
+    def getStatus(self):
+        with self.lock:
+            jobs = [job.getMetrics() for job in self.jobs.values()]
+
+        latencies = sorted(job['latency'] for job in jobs if 'latency' in job)
+
+        return {
+            'workers': self.numWorkers,
+            'queued': self.queue.qsize(),
+            'dataCache': self.dataCache.entries.stats(),
+            'plotCache': self.plotStore.plots.stats(),
+            'latency': {
+                'count': len(latencies),
+                'median': latencies[len(latencies) // 2] if latencies else None,
+                'max': latencies[-1] if latencies else None
+            },
+            'jobs': jobs
+        }
+
+    def serve(self, host='127.0.0.1', port=8765, socketPath=None):
+        if socketPath:
+            if os.path.exists(socketPath):
+                os.remove(socketPath)
+
+            self.httpServer = UnixHTTPServer(socketPath, ReportRequestHandler)
+        else:
+            self.httpServer = ThreadingHTTPServer((host, port), ReportRequestHandler)
+
+        self.httpServer.reportServer = self
+        self.start()
+
+        try:
+            self.httpServer.serve_forever()
+        finally:
+            self.httpServer.server_close()
+
+            if socketPath and os.path.exists(socketPath):
+                os.remove(socketPath)
+
+    def shutdown(self):
+        if self.httpServer is not None:
+            self.httpServer.shutdown()
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def get_request(self):
+        request, clientAddress = UnixStreamServer.get_request(self)
+
+        return request, ('local', 0)
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    def sendJson(self, code, data):
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendResult(self, job):
+        metrics = job.getMetrics()
+
+        if job.error:
+            return self.sendJson(500, metrics)
+
+        self.send_response(200)
+        self.send_header('Content-Type', job.contentType)
+        self.send_header('Content-Length', str(len(job.result)))
+        self.send_header('X-Job-Id', job.id)
+        self.send_header('X-Queue-Time', '%.6f' % metrics['queueTime'])
+        self.send_header('X-Run-Time', '%.6f' % metrics['runTime'])
+        self.end_headers()
+        self.wfile.write(job.result)
+
+    def do_GET(self):
+        reportServer = self.server.reportServer
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+
+        if parts == ['status']:
+            return self.sendJson(200, reportServer.getStatus())
+
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = reportServer.getJob(parts[1])
+
+            if job is None:
+                return self.sendJson(404, {'error': 'unknown job %s' % parts[1]})
+
+            if len(parts) == 2:
+                return self.sendJson(200, job.getMetrics())
+
+            if parts[2] == 'result':
+                if not job.done.is_set():
+                    return self.sendJson(409, job.getMetrics())
+
+                return self.sendResult(job)
+
+        self.sendJson(404, {'error': 'not found'})
+
+    def do_POST(self):
+        reportServer = self.server.reportServer
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+
+        if len(parts) != 1 or parts[0] not in ('report', 'spreadsheet'):
+            return self.sendJson(404, {'error': 'not found'})
+
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            wait = spec.pop('wait', True)
+            job = reportServer.submit(parts[0], spec)
+        except (ValueError, AttributeError) as e:
+            return self.sendJson(400, {'error': str(e)})
+        except Full:
+            return self.sendJson(503, {'error': 'job queue is full'})
+
+        if not wait:
+            return self.sendJson(202, job.getMetrics())
+
+        job.done.wait()
+        self.sendResult(job)
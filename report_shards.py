@@ -0,0 +1,222 @@
+import os
+import shutil
+import tempfile
+import collections
+import multiprocessing
+from io import BytesIO
+from reportlab.lib.units import inch
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.rl_config import defaultPageSize
+
+from pipeline_trace import PipelineTrace
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    try:
+        from PyPDF2 import PdfReader, PdfWriter
+    except ImportError:
+        try:
+            from PyPDF2 import PdfFileReader as PdfReader, PdfFileWriter as PdfWriter
+        except ImportError:
+            PdfReader = PdfWriter = None
+
+ShardPage = collections.namedtuple('ShardPage', ['page'])
+
+shardState = None
+
+class ShardDocTemplate(SimpleDocTemplate):
+    def __init__(self, filename, **kw):
+        SimpleDocTemplate.__init__(self, filename, **kw)
+        self.headings = []
+
+    def afterFlowable(self, flowable):
+        if isinstance(flowable, Paragraph) and flowable.style.name in ('Heading1', 'Heading2'):
+            self.headings.append((int(flowable.style.name[-1]) - 1, flowable.getPlainText(), self.page))
+
+def countPages(pdf):
+    return len(pdf.pages) if hasattr(pdf, 'pages') else pdf.getNumPages()
+
+def mergePage(page, overlay):
+    if hasattr(page, 'merge_page'):
+        page.merge_page(overlay)
+    else:
+        page.mergePage(overlay)
+
+def addPage(writer, page):
+    if hasattr(writer, 'add_page'):
+        return writer.add_page(page)
+
+    writer.addPage(page)
+
+    return page
+
+def addOutlineItem(writer, text, page, parent=None):
+    if hasattr(writer, 'add_outline_item'):
+        return writer.add_outline_item(text, page, parent)
+
+    return writer.addBookmark(text, page, parent)
+
+def buildPart(path, story):
+    doc = ShardDocTemplate(path)
+    doc.build(story)
+
+    return path, doc.headings
+
+def initShards(state):
+    global shardState
+    shardState = state
+
+def getShardOptions(report):
+    return dict(report.options, _docName='part.pdf', _numWorkers=1, _shardWorkers=1, _cacheDir=None, _plotStoreDir=None,
+                _storeDir=None, _traceFile=None, _comparisonDir=None, _qcFile=None)
+
+def initShardWorker(options, qcReport, comparisons, data, plots, parts, partsDir):
+    from report_gen import FishReport
+
+    report = FishReport(**options)
+    report.qcReport = qcReport
+    report.comparisons = comparisons
+    initShards((report, data, plots, parts, partsDir))
+
+def buildShard(index):
+    report, data, plots, parts, partsDir = shardState
+    trace = PipelineTrace()
+
+    with trace.stage('build', part=index):
+        part = parts[index]
+
+        if part == 'qc':
+            story = report.createQcStory()
+        elif part == 'metrics':
+            story = report.createMetricStory(plots)
+        else:
+            story = report.createFishStory(data, part)
+
+        path, headings = buildPart(os.path.join(partsDir, 'part%04d.pdf' % index), story)
+
+    return path, headings, trace.spans
+
+def createContents(report, entries):
+    rows = [[text, '%d' % page] for level, text, page in entries]
+    style = [('FONTSIZE', (0, 0), (-1, -1), 10), ('ALIGN', (1, 0), (1, -1), 'RIGHT')]
+
+    for row, (level, text, page) in enumerate(entries):
+        if level:
+            style.append(('LEFTPADDING', (0, row), (0, row), 6 + 18 * level))
+            style.append(('FONTSIZE', (0, row), (-1, row), 9))
+
+    story = [Spacer(1, 2 * inch), Paragraph('Contents', report.styleH1)]
+
+    if rows:
+        table = Table(rows, colWidths=[report.doc.width - inch, inch], hAlign='LEFT')
+        table.setStyle(TableStyle(style))
+        story.append(table)
+
+    front = BytesIO()
+    SimpleDocTemplate(front).build(story, onFirstPage=report.titlePage)
+
+    return front.getvalue()
+
+def createPageNumbers(report, pageCount):
+    overlay = BytesIO()
+    canvas = Canvas(overlay, pagesize=defaultPageSize)
+
+    for page in range(1, pageCount + 1):
+        if page > 1:
+            report.regularPage(canvas, ShardPage(page))
+
+        canvas.showPage()
+
+    canvas.save()
+
+    return overlay.getvalue()
+
+def mergeParts(report, parts):
+    streams = [open(path, 'rb') for path, headings in parts]
+
+    try:
+        readers = [PdfReader(stream) for stream in streams]
+        counts = [countPages(reader) for reader in readers]
+        frontPages = 1
+
+        for attempt in range(3):
+            entries = []
+            start = frontPages
+
+            for (path, headings), count in zip(parts, counts):
+                entries.extend((level, text, start + page) for level, text, page in headings)
+                start += count
+
+            front = PdfReader(BytesIO(createContents(report, entries)))
+
+            if countPages(front) == frontPages:
+                break
+
+            frontPages = countPages(front)
+
+        overlay = PdfReader(BytesIO(createPageNumbers(report, countPages(front) + sum(counts))))
+        writer = PdfWriter()
+
+        for reader in [front] + readers:
+            for page in reader.pages:
+                number = countPages(writer)
+                page = addPage(writer, page)
+
+                if number:
+                    mergePage(page, overlay.pages[number])
+
+        parent = None
+
+        for level, text, page in entries:
+            if level:
+                addOutlineItem(writer, text, page - 1, parent)
+            else:
+                parent = addOutlineItem(writer, text, page - 1)
+
+        if hasattr(report.docName, 'write'):
+            writer.write(report.docName)
+        else:
+            with open(report.docName, 'wb') as fp:
+                writer.write(fp)
+    finally:
+        for stream in streams:
+            stream.close()
+
+def buildShardedDocument(report, plots, data):
+    if PdfWriter is None:
+        raise ImportError('Sharded report builds need pypdf or PyPDF2')
+
+    parts = (['qc'] if report.qcReport is not None else []) + ['metrics'] + (report.getFishParts(data) if report.fishPages else [])
+    partsDir = tempfile.mkdtemp(prefix='fish-report-parts-')
+    try:
+        if report.shardWorkers == 1 or len(parts) < 2:
+            initShards((report, data, plots, parts, partsDir))
+
+            try:
+                results = [buildShard(index) for index in range(len(parts))]
+            finally:
+                initShards(None)
+        else:
+            pool = multiprocessing.Pool(min(report.shardWorkers, len(parts)), initShardWorker,
+                                        (getShardOptions(report), report.qcReport, report.comparisons, data, plots, parts, partsDir))
+
+            try:
+                results = pool.map(buildShard, range(len(parts)))
+            finally:
+                pool.close()
+                pool.join()
+
+        for path, headings, spans in results:
+            report.trace.merge(spans)
+
+        built = [(path, headings) for path, headings, spans in results]
+
+        if report.traceAppendix:
+            built.append(buildPart(os.path.join(partsDir, 'trace.pdf'), report.createTraceStory()))
+
+        with report.trace.stage('merge', parts=len(built)):
+            mergeParts(report, built)
+    finally:
+        shutil.rmtree(partsDir, ignore_errors=True)
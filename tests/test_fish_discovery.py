@@ -0,0 +1,13 @@
+import unittest
+
+from fish_discovery import parseStatisticsName, parseStatisticsFile, checkStatisticsFile
+
+class StatisticsNameTest(unittest.TestCase):
+    def testStackStartingAtZeroKeepsItsLength(self):
+        fileName = 'statistics_1200.5_300.25_z0_z120_fish7.csv'
+
+        self.assertIsNone(checkStatisticsFile(parseStatisticsFile(fileName)))
+        self.assertEqual(parseStatisticsName(fileName), (1200.5, 300.25, 120.))
+
+if __name__ == '__main__':
+    unittest.main()
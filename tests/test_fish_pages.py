@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import pandas as pd
+
+from fish_gen import FishMaker
+from fish_cohort import FishCohort, makeGrid
+from report_gen import FishReport
+
+class FishPagesTest(unittest.TestCase):
+    def setUp(self):
+        self.statisticsDir = tempfile.mkdtemp(prefix='fish-pages-test-')
+        self.maker = FishMaker([1, 2, 3, 4], _seed=7, _sliceRange=(30, 90))
+        self.paths = self.maker.generate_statistics(self.statisticsDir)
+        self.fishNames = [self.maker.fishPrefix + str(fishNumber) for fishNumber in self.maker.fishNumbers]
+
+    def tearDown(self):
+        shutil.rmtree(self.statisticsDir, ignore_errors=True)
+
+    def getRows(self, table):
+        return dict((row[0], row[1]) for row in table._cellvalues)
+
+    def testGriddedSliceCounts(self):
+        report = FishReport(repr({'A': self.fishNames[:2], 'B': self.fishNames[2:]}), self.statisticsDir,
+                            _mandatoryStats=['Area', 'Circularity'], _plotMode='bands', _fishPages=True,
+                            _docName=os.path.join(self.statisticsDir, 'report.pdf'))
+        data = report.readCohort(self.statisticsDir)
+
+        self.assertIsNotNone(data.grid)
+
+        for fishName, path in zip(self.fishNames, self.paths):
+            index = data.labels.tolist().index(fishName)
+            rows = self.getRows(report.createFishTable(data, index))
+
+            self.assertEqual(rows['Slices'], '%d' % len(pd.read_csv(path, sep=';')))
+
+    def testResampledScalarMetrics(self):
+        rng = np.random.RandomState(0)
+        series = {'Area': [rng.uniform(1, 10, n) for n in (12, 40, 75)], 'Perim.': [rng.uniform(1, 10, n) for n in (12, 40, 75)]}
+        raw = FishCohort.fromSeries(['a', 'b', 'c'], ['A', 'A', 'B'], series)
+        gridded = raw.resample(makeGrid(1), ['Area'])
+
+        self.assertEqual(gridded.sliceCounts.tolist(), [12, 40, 75])
+        self.assertEqual(gridded.select([2, 0]).sliceCounts.tolist(), [75, 12])
+
+        for name in ['Volume', 'Surface', 'Length']:
+            np.testing.assert_allclose(gridded.getDataByColumn(name, [1, 1, 2]), raw.getDataByColumn(name, [1, 1, 2]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+import numpy as np
+
+from fish_cohort import FishCohort
+from fish_qc import runQualityChecks, excludeFlagged
+
+class QualityCheckTest(unittest.TestCase):
+    def createCohort(self, areaScale):
+        rng = np.random.RandomState(11)
+        profile = np.sin(np.linspace(0, np.pi, 62)[1:-1])
+        classNames = ['Wild'] * 10 + ['Mut'] * 2
+        areas, perims = [], []
+
+        for scale in areaScale:
+            radius = 20 * profile + 1 + rng.normal(0, 0.3, len(profile))
+            areas.append(scale * np.pi * radius ** 2)
+            perims.append(np.sqrt(scale) * 2 * np.pi * radius * (1 + rng.normal(0, 0.02, len(profile))))
+
+        labels = ['fish%d' % i for i in range(len(classNames))]
+
+        return FishCohort.fromSeries(labels, classNames, {'Area': areas, 'Perim.': perims})
+
+    def testShiftedMinorityClassIsKept(self):
+        cohort = self.createCohort([1.] * 10 + [3., 3.2])
+        report = runQualityChecks(cohort, ['Area', 'Circularity'], ['Area', 'Perim.'])
+
+        self.assertEqual([fish['label'] for fish in report['fish'] if fish['flagged']], [])
+        self.assertEqual(len(excludeFlagged(cohort, report).classes), 2)
+
+    def testOutlierWithinClassIsFlagged(self):
+        cohort = self.createCohort([1.] * 9 + [10.] + [3., 3.2])
+        report = runQualityChecks(cohort, ['Area', 'Circularity'], ['Area', 'Perim.'])
+
+        self.assertEqual([fish['label'] for fish in report['fish'] if fish['flagged']], ['fish9'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from pandas import DataFrame
+
+from fish_store import StoreWriter
+from report_gen import FishReport
+from data_concatenator import FishDataConcatenator
+
+class FishStoreReportTest(unittest.TestCase):
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix='fish-store-test-')
+        self.storeDir = os.path.join(self.workDir, 'store')
+        self.classes = {'A': ['fish1', 'fish2'], 'B': ['fish3']}
+        rng = np.random.RandomState(3)
+        writer = StoreWriter(self.storeDir)
+
+        for fishClass, fishNames in sorted(self.classes.items()):
+            for fishName in fishNames:
+                count = rng.randint(20, 60)
+                dataFrame = DataFrame({'Area': rng.uniform(50, 100, count), 'Perim.': rng.uniform(20, 40, count)})
+                writer.add(fishName, fishClass, dataFrame, (0, 0, 0), (2, 0.5, 3), fishName + '.csv')
+
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def createReport(self, **options):
+        return FishReport(repr(self.classes), self.workDir, _mandatoryStats=['Area', 'Circularity'], _fishPages=True,
+                          _storeDir=self.storeDir, _docName=os.path.join(self.workDir, 'report.pdf'), **options)
+
+    def readSpreadsheetData(self):
+        concatenator = FishDataConcatenator(repr(self.classes), self.workDir, os.path.join(self.workDir, 'spreadsheets'),
+                                            _storeDir=self.storeDir)
+
+        return concatenator, concatenator.readFishData(self.workDir, concatenator.args)
+
+    def testReportMatchesSpreadsheets(self):
+        report = self.createReport()
+        data = report.readCohort(self.workDir)
+        concatenator, spreadsheetData = self.readSpreadsheetData()
+
+        for name in ['Volume', 'Surface', 'Length']:
+            spreadsheet = concatenator.getSpreadsheetFrame(spreadsheetData, name)[name]
+
+            for index, fishName in enumerate(data.labels):
+                rows = dict((row[0], row[1]) for row in report.createFishTable(data, index)._cellvalues)
+
+                self.assertEqual(rows[name], '%.4g' % spreadsheet[fishName])
+
+        for name in ['Area', 'Circularity']:
+            spreadsheet = concatenator.getSpreadsheetFrame(spreadsheetData, name)
+
+            for index, fishName in enumerate(data.labels):
+                values = spreadsheet[fishName].values[:data.lengths[index]]
+
+                np.testing.assert_allclose(data.getFishSeries(name, index, report.voxelSize), values)
+
+    def testVoxelSizeOverride(self):
+        stored = self.createReport()
+        overridden = self.createReport(_voxelSize=[1, 1, 1])
+        storedData = stored.readCohort(self.workDir)
+        overriddenData = overridden.readCohort(self.workDir)
+
+        np.testing.assert_allclose(storedData.getDataByColumn('Volume', stored.voxelSize),
+                                   overriddenData.getDataByColumn('Volume', overridden.voxelSize) * 3)
+
+if __name__ == '__main__':
+    unittest.main()
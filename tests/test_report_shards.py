@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+import report_shards
+from fish_gen import FishMaker
+from report_gen import FishReport
+
+@unittest.skipIf(report_shards.PdfWriter is None, 'sharded builds need pypdf or PyPDF2')
+class ShardedBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix='fish-shards-test-')
+        maker = FishMaker([1, 2, 3, 4], _seed=5, _sliceRange=(30, 60))
+        maker.generate_statistics(self.workDir)
+        self.classes = {'A': ['fish1', 'fish2'], 'B': ['fish3', 'fish4']}
+        self.multiprocessing = report_shards.multiprocessing
+
+    def tearDown(self):
+        report_shards.multiprocessing = self.multiprocessing
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def build(self, docName, **options):
+        report = FishReport(repr(self.classes), self.workDir, _docName=os.path.join(self.workDir, docName),
+                            _mandatoryStats=['Area', 'Circularity'], _shardBy='class', _qc=True, _comparison=['welch'], **options)
+        report.generate()
+
+        with open(report.docName, 'rb') as fp:
+            reader = report_shards.PdfReader(fp)
+
+            return report_shards.countPages(reader)
+
+    @unittest.skipUnless(hasattr(multiprocessing, 'get_context'), 'needs multiprocessing start methods')
+    def testSpawnedWorkers(self):
+        expected = self.build('serial.pdf', _shardWorkers=1)
+        report_shards.multiprocessing = multiprocessing.get_context('spawn')
+
+        self.assertEqual(self.build('spawn.pdf', _shardWorkers=2), expected)
+        self.assertEqual(self.build('spawn-vector.pdf', _shardWorkers=2, _plotFormat='vector'), expected)
+
+if __name__ == '__main__':
+    unittest.main()
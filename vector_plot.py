@@ -0,0 +1,134 @@
+import numpy as np
+import matplotlib.cm as cmx
+from matplotlib.ticker import MaxNLocator
+from reportlab.lib import colors
+from reportlab.graphics.shapes import Drawing, Group, Line, PolyLine, Polygon, Rect, String
+
+def decimateMinMax(x, y, columns):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+
+    if len(x) <= 4 * columns or x[-1] <= x[0]:
+        return x, y
+
+    bins = np.minimum(((x - x[0]) / (x[-1] - x[0]) * columns).astype(np.intp), columns - 1)
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    ends = np.r_[starts[1:], len(x)] - 1
+
+    order = np.lexsort((y, bins))
+    keep = np.unique(np.concatenate([starts, ends, order[starts], order[ends]]))
+
+    return x[keep], y[keep]
+
+def toColor(rgba, alpha=1.):
+    return colors.Color(rgba[0], rgba[1], rgba[2], alpha=alpha)
+
+class VectorPlot:
+    def __init__(self, _width, _style):
+        self.style = _style
+        self.width = _width
+        self.height = _width * _style['figsize'][1] / float(_style['figsize'][0])
+        left, bottom, width, height = _style['position']
+        self.box = (left * self.width, bottom * self.height, width * self.width, height * self.height)
+        self.fontSize = 7
+
+    def getLimits(self, ys):
+        finite = [v[np.isfinite(v)] for v in ys if np.isfinite(v).any()]
+
+        if not finite:
+            return 0., 1.
+
+        ymin = min(v.min() for v in finite)
+        ymax = max(v.max() for v in finite)
+        margin = (ymax - ymin) * 0.05 or 1.
+
+        return ymin - margin, ymax + margin
+
+    def build(self, plotData):
+        group = Group()
+        grid = plotData['grid']
+
+        if not plotData['series'] and not plotData['bands']:
+            return Drawing(self.width, self.height)
+
+        bx, by, bw, bh = self.box
+        entries = []
+
+        if plotData['bands']:
+            bandColors = cmx.hsv(np.linspace(0, 1, len(plotData['bands']), endpoint=False))
+            ys = [edge for className, band in plotData['bands'] for edge in (band['low'], band['high'])]
+        else:
+            fishColors = cmx.hsv(np.linspace(0, 1, len(plotData['series'])))
+            ys = [values for fishName, x, values in plotData['series']]
+
+        xmin, xmax = 0., 100.
+        ymin, ymax = self.getLimits(ys)
+        sx = lambda x: bx + (np.asarray(x) - xmin) / (xmax - xmin) * bw
+        sy = lambda y: by + (np.asarray(y) - ymin) / (ymax - ymin) * bh
+
+        for tick in MaxNLocator(nbins=6).tick_values(ymin, ymax):
+            if ymin <= tick <= ymax:
+                group.add(Line(bx, sy(tick), bx + bw, sy(tick), strokeColor=colors.lightgrey, strokeWidth=0.4))
+                group.add(String(bx - 3, sy(tick) - 2, '%g' % tick, fontSize=self.fontSize, textAnchor='end'))
+
+        for tick in range(0, 101, 20):
+            group.add(Line(sx(tick), by, sx(tick), by + bh, strokeColor=colors.lightgrey, strokeWidth=0.4))
+            group.add(String(sx(tick), by - 9, '%d%%' % tick, fontSize=self.fontSize, textAnchor='middle'))
+
+        if plotData['bands']:
+            for (className, band), rgba in zip(plotData['bands'], bandColors):
+                finite = np.isfinite(band['low']) & np.isfinite(band['high'])
+                xs = np.r_[grid[finite], grid[finite][::-1]]
+                edge = np.r_[band['low'][finite], band['high'][finite][::-1]]
+                points = np.column_stack([sx(xs), sy(edge)]).ravel().tolist()
+
+                if points:
+                    group.add(Polygon(points, fillColor=toColor(rgba, 0.25), strokeColor=None))
+
+                for key, dash, label in (('mean', None, '%s (mean)'), ('median', (3, 2), '%s (median)')):
+                    finite = np.isfinite(band[key])
+                    group.add(PolyLine(np.column_stack([sx(grid[finite]), sy(band[key][finite])]).ravel().tolist(), strokeColor=toColor(rgba), strokeWidth=0.8, strokeDashArray=dash))
+                    entries.append((label % className, toColor(rgba), dash))
+
+            for k, ((classA, classB), significant) in enumerate(plotData['markers']):
+                for x in grid[significant]:
+                    group.add(String(sx(x), by + bh * (0.98 - 0.03 * k) - 2, '*', fontSize=self.fontSize, textAnchor='middle'))
+
+                entries.append(('p < %g: %s / %s' % (plotData['alpha'], classA, classB), colors.black, None))
+        else:
+            for (fishName, x, y), rgba in zip(plotData['series'], fishColors):
+                if len(x):
+                    group.add(PolyLine(np.column_stack([sx(x), sy(y)]).ravel().tolist(), strokeColor=toColor(rgba), strokeWidth=0.6))
+
+                entries.append((fishName, toColor(rgba), None))
+
+        group.add(Rect(bx, by, bw, bh, fillColor=None, strokeColor=colors.black, strokeWidth=0.6))
+        group.add(String(bx + bw / 2., by - 20, 'Number of slice (%)', fontSize=self.fontSize + 1, textAnchor='middle'))
+
+        yLabel = Group(String(0, 0, plotData['yLabel'], fontSize=self.fontSize + 1, textAnchor='middle'))
+        yLabel.translate(bx - 35, by + bh / 2.)
+        yLabel.rotate(90)
+        group.add(yLabel)
+
+        rows = self.addLegend(group, entries, min(self.style['legendColumns'], 3) if plotData['bands'] else self.style['legendColumns'])
+        overflow = max(0, rows * (self.fontSize + 3) - (self.box[1] - 32 + self.fontSize))
+
+        group.translate(0, overflow)
+        result = Drawing(self.width, self.height + overflow)
+        result.add(group)
+
+        return result
+
+    def addLegend(self, group, entries, ncol):
+        entryWidth = self.width / float(ncol)
+        top = self.box[1] - 32
+
+        for k, (label, color, dash) in enumerate(entries):
+            x = (k % ncol) * entryWidth
+            y = top - (k // ncol) * (self.fontSize + 3)
+            group.add(Line(x + 2, y + 2, x + 14, y + 2, strokeColor=color, strokeWidth=1, strokeDashArray=dash))
+            group.add(String(x + 17, y, label, fontSize=self.fontSize))
+
+        return (len(entries) + ncol - 1) // ncol